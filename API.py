@@ -3,6 +3,7 @@ import json
 import os
 import urlparse
 import sys
+import zlib
 
 class MissingArgError(Bigrams.Error):
     """
@@ -63,34 +64,46 @@ class EdgeUnknownError(Bigrams.EdgeUnknownError):
     """
     pass
 
-class API(Bigrams.Game_API):
-
-    def __init__(self, dbname, read_gpickle=False):
-        super(API, self).__init__(dbname, read_gpickle=read_gpickle)
-        self._load_graph()
+class Request(object):
+    """
+    State of one API call: the WSGI environ and its args, parsed once. It is passed to the
+    API's service methods so that concurrent calls share nothing but the API's caches.
+    """
 
-    def _load_graph(self):
-        self._graph()
+    def __init__(self, environ, args=None):
+        self.environ = environ
+        self.args_ = args
+        self.body_ = None
 
-    def _get_page(self):
+    def page(self):
         return self.environ['PATH_INFO'][1:].split('/')[0]
 
-    def _get_method(self):
-        return getattr(self, "%s_" % (self._get_page()))
+    def args(self):
+        if self.args_ is None:
+            self.args_ = urlparse.parse_qs(self.environ.get('QUERY_STRING', ''))
+        return self.args_
 
-    def _args(self):
-        if self.__args is None:
-            self.__args = urlparse.parse_qs(self.environ['QUERY_STRING'])
-        return self.__args
+    def if_none_match(self):
+        """
+        Returns: List of the entity tags in the If-None-Match header, weak tags without their W/ prefix
+        """
+        tags = [tag.strip() for tag in self.environ.get('HTTP_IF_NONE_MATCH', '').split(',')]
+        return [tag[2:] if tag.startswith('W/') else tag for tag in tags if tag]
 
-    def _get_arg(self, key, type=str, subtype=None, optional=False):
+    def body(self):
+        if self.body_ is None:
+            length = int(self.environ.get('CONTENT_LENGTH') or 0)
+            self.body_ = self.environ['wsgi.input'].read(length) if length else ''
+        return self.body_
+
+    def get_arg(self, key, type=str, subtype=None, optional=False):
         # arg is not in query string
-        if not key in self._args():
+        if not key in self.args():
             if optional:
                 return None
             raise MissingArgError(key)
 
-        arg = self._args()[key][0]
+        arg = self.args()[key][0]
 
         # arg is empty
         if arg == '' and not optional:
@@ -111,27 +124,181 @@ class API(Bigrams.Game_API):
                     raise InvalidArgError(key, arg)
         return arg
 
-    def set_environ(self, environ):
-        self.environ = environ
+class API(Bigrams.Game_API):
+
+    BATCH_OPS = ['get_node', 'random_node', 'random_nodes', 'random_node_by_distance', 'random_pair_by_distance', 'distance', 'distances',
+                 'shortest_path', 'sense_path', 'about', 'cache_stats']
+    MAX_BATCH_OPS = 100
+    # services whose response depends only on their args and the graph
+    CACHEABLE = ['get_node', 'distance', 'distances', 'shortest_path', 'sense_path', 'about']
+
+    def __init__(self, dbname, read_gpickle=False, engine='networkx', read_snapshot=False, write_snapshot=False, landmarks=0,
+                 path_cache_entries=100000, path_cache_size=None, path_cache_policy='lru', layer_cache_entries=100,
+                 pair_index=False, glosses='lazy', gloss_cache_entries=100000, response_cache_entries=10000, response_cache_size=None,
+                 verify_snapshot=False):
+        self.response_cache_entries = response_cache_entries
+        self.response_cache_size = response_cache_size
+        self.responses_ = None
+        super(API, self).__init__(dbname, read_gpickle=read_gpickle, engine=engine, read_snapshot=read_snapshot, write_snapshot=write_snapshot, landmarks=landmarks,
+                                  path_cache_entries=path_cache_entries, path_cache_size=path_cache_size, path_cache_policy=path_cache_policy,
+                                  layer_cache_entries=layer_cache_entries, pair_index=pair_index, glosses=glosses,
+                                  gloss_cache_entries=gloss_cache_entries, verify_snapshot=verify_snapshot)
+        self._load_graph()
+
+    def _load_graph(self):
+        self._graph()
+        self._lexicon()
+        if self.num_landmarks:
+            self._landmarks()
+        if self.pair_index:
+            self._pair_index()
+        if self.glosses == 'store':
+            self._gloss_store()
+        else:
+            self._gloss_cache()
+        # create the remaining lazy state up front so concurrent requests never race to build it
+        if self.engine == 'csr':
+            self._graph().path_finder()
+        self._paths()
+        self._layers()
+        self._node_ids()
+        if self.engine != 'csr':
+            self._link_names()
+        self._num_components()
+        self._responses()
+        self.graph_version()
+
+    def _responses(self):
+        if self.responses_ is None:
+            self.responses_ = Bigrams.nt.Tools.Cache(max_entries=self.response_cache_entries, max_size=self.response_cache_size,
+                                                     sizeof=len, policy=self.path_cache_policy)
+        return self.responses_
+
+    def _response_key(self, request):
+        """
+        Returns: (service, args, graph version) identifying the response to request, None if the
+        service's response may change from one call to the next
+        """
+        if not request.page() in self.CACHEABLE:
+            return None
+        args = tuple(sorted([(key, tuple(vals)) for key, vals in request.args().items()]))
+        return (request.page(), args, self.graph_version())
+
+    def _etag(self, request):
+        """
+        Returns: Entity tag of the response to request, None if it is not cacheable
+        """
+        key = self._response_key(request)
+        if key is None:
+            return None
+        return '"%s-%08x"' % (self.graph_version(), zlib.crc32(repr(key)) & 0xffffffff)
+
+    def _get_method(self, request):
+        return getattr(self, "%s_" % (request.page()))
 
-    def _application(self):
-        self.__args = None
+    def _application(self, request):
+        return self._respond(request)[0]
 
+    def _respond(self, request):
+        """
+        Returns: (content, etag) answering request, etag None unless the response is a cacheable success
+        """
+        method = self._get_method(request)
+        key = self._response_key(request)
+        if key is None:
+            return [ json.dumps(self._run(method, request)) ], None
+
+        content = self._responses().get(key)
+        if content is None:
+            result = self._run(method, request)
+            content = json.dumps(result)
+            if isinstance(result, dict) and 'error' in result:
+                return [ content ], None
+            self._responses().put(key, content)
+        return [ content ], self._etag(request)
+
+    def _run(self, method, request):
+        """
+        Returns: Result of method run for request, or the hash of the error it raised
+        """
         try:
-            return [ json.dumps(self._get_method()(urlparse.parse_qs(self.environ['QUERY_STRING']))) ]
+            return method(request)
         except (MissingArgError, NodeUnknownError, PathUnknownError, EdgeUnknownError, InvalidArgError) as exc:
             exc.trace(sys.exc_info())
-            return [ json.dumps({'error': exc.code(), 'msg': str(exc)}) ]
+            return {'error': exc.code(), 'msg': str(exc)}
+
+    def _get_ops(self, request):
+        """
+        Returns: List of batch operations from the 'ops' arg, else from the request body
+        """
+        if 'ops' in request.args():
+            body = request.get_arg('ops')
+        else:
+            body = request.body()
+        if not body:
+            raise MissingArgError('ops')
+
+        try:
+            ops = json.loads(body)
+        except ValueError:
+            raise InvalidArgError('ops', body)
+        if not isinstance(ops, list) or len(ops) > self.MAX_BATCH_OPS:
+            raise InvalidArgError('ops', body)
+        return ops
+
+    def _batch_value(self, key, val, results):
+        """
+        Returns: val as a query string value, after resolving a "$<index>.<key>..." reference to
+        an earlier result
+        """
+        if isinstance(val, basestring) and val.startswith('$'):
+            ref = val
+            try:
+                parts = val[1:].split('.')
+                index = int(parts[0])
+                if index < 0 or index >= len(results) or 'error' in results[index]:
+                    raise InvalidArgError(key, ref)
+                val = results[index]
+                for part in parts[1:]:
+                    val = val[int(part)] if isinstance(val, list) else val[part]
+            except (ValueError, KeyError, IndexError, TypeError):
+                raise InvalidArgError(key, ref)
+
+        if isinstance(val, list):
+            return ','.join([self._batch_value(key, item, results) for item in val])
+        if isinstance(val, bool):
+            return 'true' if val else 'false'
+        if val is None:
+            return ''
+        if isinstance(val, unicode):
+            return val.encode('utf-8')
+        return str(val)
+
+    def _run_op(self, request, op, results):
+        """
+        Returns: Result of one batch operation, or the hash of its error
+        """
+        try:
+            if not isinstance(op, dict) or not op.get('op') in self.BATCH_OPS:
+                raise InvalidArgError('op', json.dumps(op))
+            args = op.get('args') or {}
+            if not isinstance(args, dict):
+                raise InvalidArgError('args', json.dumps(args))
+            args = dict([(str(key), [self._batch_value(key, val, results)]) for key, val in args.items()])
+        except InvalidArgError as exc:
+            exc.trace(sys.exc_info())
+            return {'error': exc.code(), 'msg': str(exc)}
+        return self._run(getattr(self, "%s_" % (op['op'])), Request(request.environ, args))
 
     def _node_hash(self, node):
         if node[0] is None or node[1] is None:
             raise NodeUnknownError()
         return {'ref': node[0], 'word': node[1]}
 
-    # def test_(self, args):
-    #      return [{key: str(val)} for key, val in self.environ.iteritems()]
+    # def test_(self, request):
+    #      return [{key: str(val)} for key, val in request.environ.iteritems()]
 
-    def get_node_(self, args):
+    def get_node_(self, request):
         """
         Service: get_node
         Description: Return a node (ref, word) pair by supplying either a 'ref' or a 'word'
@@ -143,15 +310,15 @@ class API(Bigrams.Game_API):
         http://<remote_host>:<port>/get_node?ref=1234
         http://<remote_host>:<port>/get_node?word=foobar
         """
-        ref = self._get_arg('ref', type=int, optional=True)
-        word = self._get_arg('word', optional=True)
+        ref = request.get_arg('ref', type=int, optional=True)
+        word = request.get_arg('word', optional=True)
 
         if ref is None and word is None:
             raise MissingArgError(['ref', 'word'])
 
         return self._node_hash(self.node(ref=ref, word=word))
 
-    def random_node_by_distance_(self, args):
+    def random_node_by_distance_(self, request):
         """
         Service: random_node_by_distance
         Description: Return a node (ref, word) pair that is within a certian distance from a ref
@@ -164,26 +331,81 @@ class API(Bigrams.Game_API):
         http://<remote_host>:<port>/random_node_by_distance?ref=1234&min_distance=3&max_distance=3
         """
         try:
-            return self._node_hash(self.random_node_by_distance(self._get_arg('ref', type=int),
-                                                                self._get_arg('min_distance', type=int),
-                                                                self._get_arg('max_distance', type=int, optional=True)))
+            return self._node_hash(self.random_node_by_distance(request.get_arg('ref', type=int),
+                                                                request.get_arg('min_distance', type=int),
+                                                                request.get_arg('max_distance', type=int, optional=True)))
         except Bigrams.PathUnknownError as exc:
             raise PathUnknownError(exc.ref1, exc.ref2)
 
-    def random_node_(self, args):
+    def random_pair_by_distance_(self, request):
+        """
+        Service: random_pair_by_distance
+        Description: Return a pair of nodes (ref, word) that are within a certain distance of each other
+
+        Args: min_distance(int), max_distance(int, optional)
+        Returns: {'head': {'ref': ref(int), 'word': word(str)}, 'tail': {'ref': ref(int), 'word': word(str)}}
+
+        Examples:
+        http://<remote_host>:<port>/random_pair_by_distance?min_distance=3
+        http://<remote_host>:<port>/random_pair_by_distance?min_distance=5&max_distance=5
+        """
+        try:
+            head, tail = self.random_pair_by_distance(request.get_arg('min_distance', type=int), request.get_arg('max_distance', type=int, optional=True))
+        except Bigrams.PathUnknownError as exc:
+            raise PathUnknownError(exc.ref1, exc.ref2)
+        return {'head': self._node_hash(head), 'tail': self._node_hash(tail)}
+
+    def batch_(self, request):
+        """
+        Service: batch
+        Description: Run a list of operations in one request. Each operation is {"op": <service>, "args": {<arg>: <value>}},
+        where a value "$<index>.<key>..." stands for part of the result of an earlier operation
+
+        Args: ops(JSON list of operations, or the request body)
+        Returns: {'results': [<result of each operation, or its {'error': code(int), 'msg': msg(str)}>]}
+
+        Examples:
+        http://<remote_host>:<port>/batch?ops=[{"op":"random_node"},{"op":"random_node_by_distance","args":{"ref":"$0.ref","min_distance":3}},{"op":"shortest_path","args":{"ref1":"$0.ref","ref2":"$1.ref"}},{"op":"sense_path","args":{"refs":"$2.path"}}]
+        """
+        results = []
+        for op in self._get_ops(request):
+            results.append(self._run_op(request, op, results))
+        return {'results': results}
+
+    def random_node_(self, request):
         """
         Service: random_node
         Description: Return a random node (ref, word) pair
 
-        Args: None
+        Args: seed(int, optional)
         Returns: {'ref': ref(int), 'word': word(str)} 
 
         Examples:
         http://<remote_host>:<port>/random_node
+        http://<remote_host>:<port>/random_node?seed=42
+        """
+        return self._node_hash(self.random_node(seed=request.get_arg('seed', type=int, optional=True)))
+
+    def random_nodes_(self, request):
+        """
+        Service: random_nodes
+        Description: Return a list of distinct random node (ref, word) pairs
+
+        Args: n(int), seed(int, optional)
+        Returns: {'nodes': [{'ref': ref(int), 'word': word(str)}, ..., {'ref': ref(int), 'word': word(str)}]}
+
+        Examples:
+        http://<remote_host>:<port>/random_nodes?n=10
+        http://<remote_host>:<port>/random_nodes?n=10&seed=42
         """
-        return self._node_hash(self.random_node())
+        n = request.get_arg('n', type=int)
+        try:
+            nodes = self.random_nodes(n, seed=request.get_arg('seed', type=int, optional=True))
+        except ValueError:
+            raise InvalidArgError('n', n)
+        return {'nodes': [self._node_hash(node) for node in nodes]}
 
-    def distance_(self, args):
+    def distance_(self, request):
         """
         Service: distance
         Description: Return the shortest distance between two refs
@@ -195,11 +417,35 @@ class API(Bigrams.Game_API):
         http://<remote_host>:<port>/distance?ref1=1234&ref2=5678
         """
         try:
-            return {'distance': self.distance(self._get_arg('ref1', type=int), self._get_arg('ref2', type=int))}
+            return {'distance': self.distance(request.get_arg('ref1', type=int), request.get_arg('ref2', type=int))}
         except Bigrams.PathUnknownError:
-            raise PathUnknownError(self._get_arg('ref1', type=int), self._get_arg('ref2', type=int))
+            raise PathUnknownError(request.get_arg('ref1', type=int), request.get_arg('ref2', type=int))
+
+    def distances_(self, request):
+        """
+        Service: distances
+        Description: Return the shortest distances from one ref to a list of refs
 
-    def shortest_path_(self, args):
+        Args: ref(int), refs(comma separated list of ints)
+        Returns: {'distances': [{'ref': ref1(int), 'distance': distance(int)},
+                                {'ref': ref2(int), 'error': 300, 'msg': msg(str)},
+                                ...]}
+
+        Examples:
+        http://<remote_host>:<port>/distances?ref=1234&refs=12,34,56,78
+        """
+        ref = request.get_arg('ref', type=int)
+        refs = request.get_arg('refs', type=list, subtype=int)
+        out = []
+        for target, distance in zip(refs, self.distances(ref, refs)):
+            if distance is None:
+                exc = PathUnknownError(ref, target)
+                out.append({'ref': target, 'error': exc.code(), 'msg': str(exc)})
+            else:
+                out.append({'ref': target, 'distance': distance})
+        return {'distances': out}
+
+    def shortest_path_(self, request):
         """
         Service: shortest_path
         Description: Return the shortest path between two refs
@@ -211,11 +457,11 @@ class API(Bigrams.Game_API):
         http://<remote_host>:<port>/shortest_path?ref1=1234&ref2=5678
         """
         try:
-            return {'path': self.shortest_paths((self._get_arg('ref1', type=int), self._get_arg('ref2', type=int)))}
+            return {'path': self.shortest_paths((request.get_arg('ref1', type=int), request.get_arg('ref2', type=int)))}
         except Bigrams.PathUnknownError:
-            raise PathUnknownError(self._get_arg('ref1', type=int), self._get_arg('ref2', type=int))
+            raise PathUnknownError(request.get_arg('ref1', type=int), request.get_arg('ref2', type=int))
 
-    def sense_path_(self, args):
+    def sense_path_(self, request):
         """
         Service: sense_path
         Description: Return sense path given a list of refs
@@ -231,12 +477,12 @@ class API(Bigrams.Game_API):
         http://<remote_host>:<port>/sense_path?refs=12,34,56,78&exclude_homophones=True
         """
         try:
-            return {'senses': self.sense_path(self._get_arg('refs', type=list, subtype=int),
-                                              include_homophones=not self._get_arg('exclude_homophones', type=bool, optional=True))}
+            return {'senses': self.sense_path(request.get_arg('refs', type=list, subtype=int),
+                                              include_homophones=not request.get_arg('exclude_homophones', type=bool, optional=True))}
         except Bigrams.EdgeUnknownError as exc:
             raise EdgeUnknownError(exc.ref1, exc.ref2)
 
-    def about_(self, args):
+    def about_(self, request):
         """
         Service: about
         Description: Return some information about the graph
@@ -248,3 +494,24 @@ class API(Bigrams.Game_API):
         http://<remote_host>:<port>/about
         """
         return self.about()
+
+    def cache_stats_(self, request):
+        """
+        Service: cache_stats
+        Description: Return occupancy and hit/miss/eviction counters of the server caches
+
+        Args: None
+        Returns: {'paths': {'entries': entries(int), 'size': size(int), 'hits': hits(int), 'misses': misses(int), 'evictions': evictions(int)},
+                  'layers': {'entries': entries(int), 'size': size(int), 'hits': hits(int), 'misses': misses(int), 'evictions': evictions(int)},
+                  'glosses': {'entries': entries(int), 'size': size(int), 'hits': hits(int), 'misses': misses(int), 'evictions': evictions(int)},
+                  'responses': {'entries': entries(int), 'size': size(int), 'hits': hits(int), 'misses': misses(int), 'evictions': evictions(int)}}
+
+        Examples:
+        http://<remote_host>:<port>/cache_stats
+        """
+        return self.cache_stats()
+
+    def cache_stats(self):
+        stats = super(API, self).cache_stats()
+        stats['responses'] = self._responses().stats()
+        return stats
@@ -1,9 +1,20 @@
 import random
+import array
+import cPickle
+import Graph
+import itertools
+import multiprocessing
 import networkx as nx
 import numpy as np
 import noodle as nt
+import os
 import sys
+import tempfile
+import threading
+import time
 import traceback
+import warnings
+import zlib
 
 HUMAN_SOLO = 0
 
@@ -90,6 +101,48 @@ def get_database(dbname):
 
     return db
 
+def stage_relation_edges(args):
+    """
+    Pool worker for WordNet_Database.insert_relations: extracts the edges of one relation
+    over its own connection and returns the path of the staged edge file.
+    """
+    src_dbname, dst_dbname, tmp_valid_unigrams, relation_id, relation = args
+    db = WordNet_Database(src_dbname, dst_dbname)
+    db.tmp_valid_unigrams_ = tmp_valid_unigrams
+    return stage_edges(db.get_src_edges(relation_id, relation))
+
+def stage_edges(edges, chunk_size=1000):
+    """
+    Returns: Path of a temporary file holding the pickled edges
+    """
+    fp = tempfile.NamedTemporaryFile(prefix='edges', suffix='.pkl', delete=False)
+    chunk = []
+    for edge in edges:
+        chunk.append(edge)
+        if len(chunk) == chunk_size:
+            cPickle.dump(chunk, fp, cPickle.HIGHEST_PROTOCOL)
+            chunk = []
+    if chunk:
+        cPickle.dump(chunk, fp, cPickle.HIGHEST_PROTOCOL)
+    fp.close()
+    return fp.name
+
+def read_staged_edges(path):
+    """
+    Generator of the edges in a file written by stage_edges, which is removed once read.
+    """
+    try:
+        with open(path, 'rb') as fp:
+            while True:
+                try:
+                    chunk = cPickle.load(fp)
+                except EOFError:
+                    break
+                for edge in chunk:
+                    yield edge
+    finally:
+        os.remove(path)
+
 def word_fld(num):
     return 'word%d' % (num)
 
@@ -105,10 +158,17 @@ class Database(object):
         self.dbname = dbname
 
         self.config_ = None
-        self.dbh_ = None
+        self.dbhs_ = threading.local()
         self.is_directed_ = None
         self.graph_ = None
+        self.csr_graph_ = None
+        self.lexicon_ = None
         self.sense_id_first_ = None
+        self.bulk_loader_ = None
+        self.edge_set_ = None
+        self.interners_ = None
+        self.sense_ids_ = None
+        self.verify_snapshots = False
         self.config()
 
     def config(self):
@@ -117,15 +177,25 @@ class Database(object):
         return self.config_
 
     def dbh(self):
-        if self.dbh_ is None:
-            self.dbh_ = nt.SQL.connection(db=self.config().get("mysql", "default_db"),
-                                          user=self.config().get("mysql", "user"),
-                                          passwd=self.config().get("mysql", "passwd"),
-                                          unix_socket=self.config().get("mysql", "unix_socket")
-                                          )
-            if self.dbh_.db_exists(self.dbname):
-                self.dbh_.select_db(self.dbname)
-        return self.dbh_
+        """
+        Returns: this thread's connection, so that threads serving requests never share a cursor
+        """
+        if getattr(self.dbhs_, 'dbh', None) is None:
+            dbh = nt.SQL.connection(db=self.config().get("mysql", "default_db"),
+                                    user=self.config().get("mysql", "user"),
+                                    passwd=self.config().get("mysql", "passwd"),
+                                    unix_socket=self.config().get("mysql", "unix_socket")
+                                    )
+            if dbh.db_exists(self.dbname):
+                dbh.select_db(self.dbname)
+            self.dbhs_.dbh = dbh
+        return self.dbhs_.dbh
+
+    def reset_dbh(self):
+        """
+        Forget every thread's connection, e.g. in a forked child that must not share its parent's sockets
+        """
+        self.dbhs_ = threading.local()
 
     def sql_tables(self):
         return [WORDS_SQL, SENSES_SQL, BIGRAMS_SQL, LINKS_SQL, CONFIG_SQL, DIRECTED_EDGES_SQL, RELATIONS_SQL]
@@ -135,7 +205,11 @@ class Database(object):
         self.dbh().drop_database(self.dbname)
         print "NOTE: Creating database", self.dbname
         self.dbh().execute('CREATE DATABASE %s' % self.dbname)
-        self.dbh_ = None
+        self.reset_dbh()
+        self.bulk_loader_ = None
+        self.edge_set_ = None
+        self.interners_ = None
+        self.sense_ids_ = None
 
         for sql in self.sql_tables():
             self.dbh().execute(sql)
@@ -143,14 +217,76 @@ class Database(object):
         for key, val in kwargs.iteritems():
             self.dbh().execute("INSERT INTO config VALUES ('%s', '%s')" % (key, str(val)))
 
-    def insert_into_db(self, edges=None):
-        cnt = 1
+    def bulk_loader(self, method=None):
+        """
+        Returns: The database's Bulk_Loader, created with method on first use. Raises ValueError
+        if method differs from the existing loader's, whose cached next ids a second loader would reuse.
+        """
+        if self.bulk_loader_ is None:
+            self.bulk_loader_ = Bulk_Loader(self, method=method)
+        elif not method is None and method != self.bulk_loader_.method:
+            raise ValueError("bulk loader uses method '%s', not '%s'" % (self.bulk_loader_.method, method))
+        return self.bulk_loader_
+
+    def interner(self, tbl):
+        if self.interners_ is None:
+            self.interners_ = {}
+        if not tbl in self.interners_:
+            self.interners_[tbl] = Interner(self, tbl, *Interner.TABLES[tbl])
+        return self.interners_[tbl]
+
+    def sense_ids(self):
+        """
+        Returns: Set of sense_ids already written to senses
+        """
+        if self.sense_ids_ is None:
+            self.sense_ids_ = set(self.dbh().get_list("SELECT sense_id FROM senses"))
+        return self.sense_ids_
+
+    def edge_set(self):
+        if self.edge_set_ is None:
+            self.edge_set_ = Edge_Set(self.is_directed())
+            self.edge_set_.load(self.dbh().get_all("SELECT sense1_id, sense2_id FROM directed_edges"))
+        return self.edge_set_
+
+    def insert_directed_edges(self):
+        pairs = self.edge_set().pop_new_pairs()
+        if len(pairs):
+            self.dbh().insert_rows('directed_edges', ['sense1_id', 'sense2_id'], pairs, ignore=True)
+
+    def insert_into_db(self, edges=None, bulk=None, directed_edges=True, prefetch=True):
+        """
+        Insert edges as bigrams. With bulk set to one of Bulk_Loader.METHODS ids are resolved
+        client-side and rows are written in batches, otherwise each edge is inserted row by row.
+        Duplicate edges are detected in memory and the new pairs are written to directed_edges
+        once at the end, unless directed_edges is False.
+
+        Edges are consumed as a stream; with prefetch they are read ahead by a background
+        thread into a bounded queue so reading the source overlaps writing the bigrams.
+        Generators passed as edges must therefore not use this database's connection.
+        """
+        loader = None if bulk is None else self.bulk_loader(method=bulk)
+        insert_bigram = self.insert_bigram if loader is None else loader.insert_bigram
+        edges = edges if not edges is None else self.get_src_edges()
+        if prefetch:
+            edges = nt.Tools.prefetch(edges)
+
+        start = time.time()
+        cnt = 0
         insert_cnt = 0
-        for edge in edges if not edges is None else self.get_src_edges():
-            insert_cnt += self.insert_bigram(edge)
-            if cnt % 1000 == 0:
-                print cnt, insert_cnt, edge[word_fld(1)], edge[word_fld(2)], edge['link']
+        for edge in edges:
+            insert_cnt += insert_bigram(edge)
             cnt += 1
+            if cnt % 1000 == 0:
+                print cnt, insert_cnt, "%.0f/s" % (cnt / max(time.time() - start, 1e-6)), edge[word_fld(1)], edge[word_fld(2)], edge['link']
+        if not loader is None:
+            loader.flush()
+        if directed_edges:
+            self.insert_directed_edges()
+
+        elapsed = time.time() - start
+        print "NOTE: Inserted %d of %d edges in %.1fs (%.0f edges/s)" % (insert_cnt, cnt, elapsed, cnt / max(elapsed, 1e-6))
+        return insert_cnt
 
     def insert_bigram(self, edge):
         sense_id = {}
@@ -169,44 +305,54 @@ class Database(object):
     def sense_id_first(self):
         if self.sense_id_first_ is None:
             self.sense_id_first_ = 1
-        return sense_id_first_
+        return self.sense_id_first_
             
     def insert_sense(self, sense_id, word_id, ref_sense_id):
+        if not sense_id is None and sense_id in self.sense_ids():
+            return sense_id
+
         flds = ['word_id']
         vals = [str(word_id)]
         if not ref_sense_id is None:
             flds.append('ref_sense_id')
             vals.append(str(ref_sense_id))
 
-        if sense_id is None:
-            if not self.sense_id_first_ is None:
-                self.dbh().execute("INSERT INTO senses (%s) VALUES (%s)" % (','.join(flds), ','.join(vals)))
-                return self.dbh().get_last_insert_id()
-            sense_id = self.sense_id_first()
-
-        flds.append('sense_id')
-        vals.append(str(sense_id))
-        self.dbh().execute("INSERT IGNORE INTO senses (%s) VALUES (%s)" % (','.join(flds), ','.join(vals)))
+        if sense_id is None and not self.sense_id_first_ is None:
+            self.dbh().execute("INSERT INTO senses (%s) VALUES (%s)" % (','.join(flds), ','.join(vals)))
+            sense_id = self.dbh().get_insert_id()
+        else:
+            if sense_id is None:
+                sense_id = self.sense_id_first()
+            flds.append('sense_id')
+            vals.append(str(sense_id))
+            self.dbh().execute("INSERT IGNORE INTO senses (%s) VALUES (%s)" % (','.join(flds), ','.join(vals)))
+
+        self.sense_ids().add(sense_id)
         return sense_id
 
     def insert_word(self, word_id, word):
+        if word in self.interner('words'):
+            return self.interner('words').get(word)
+
         if word_id is None:
             self.dbh().execute("INSERT IGNORE INTO words (word) VALUES ('%s')" % (self.dbh().escape_string(word)))
-            if not self.dbh().get_row_cnt():
-                return self.get_word_id(word)
-            return self.dbh().get_last_insert_id()
-
-        self.dbh().execute("INSERT IGNORE INTO words VALUES (%d, '%s')" % (word_id, self.dbh().escape_string(word)))
-        return word_id
+        else:
+            self.dbh().execute("INSERT IGNORE INTO words VALUES (%d, '%s')" % (word_id, self.dbh().escape_string(word)))
+        # a word equal to a known one under the column collation, such as a case or accent
+        # variant, is ignored and answered with the id of the row it collides with
+        word_id = self.dbh().get_insert_id() or self.get_word_id(word)
+        return self.interner('words').add(word, word_id)
 
     def insert_relation(self, relation_id, relation):
+        if relation in self.interner('relations'):
+            return self.interner('relations').get(relation)
+
         if relation_id is None:
             self.dbh().execute("INSERT IGNORE INTO relations (relation) VALUES ('%s')" % (relation))
-            if not self.dbh().get_row_cnt():
-                return self.get_relation_id(relation)
-            return self.dbh().get_last_insert_id()
-        self.dbh().execute("INSERT IGNORE INTO relations (relation_id, relation) VALUES (%d, '%s')" % (relation_id, relation))
-        return relation_id
+            relation_id = self.dbh().get_insert_id() or self.get_relation_id(relation)
+        else:
+            self.dbh().execute("INSERT IGNORE INTO relations (relation_id, relation) VALUES (%d, '%s')" % (relation_id, relation))
+        return self.interner('relations').add(relation, relation_id)
 
     def remove_relations(self, relation):
         relation_id = self.get_relation_id(relation)
@@ -216,25 +362,18 @@ class Database(object):
         return relation_id
 
     def insert_link(self, link_id, link):
+        if link in self.interner('links'):
+            return self.interner('links').get(link)
+
         if link_id is None:
             self.dbh().execute("INSERT IGNORE INTO links (link) VALUES ('%s')" % (link))
-            if not self.dbh().get_row_cnt():
-                return self.get_link_id(link)
-            return self.dbh().get_last_insert_id()
-        self.dbh().execute("INSERT IGNORE INTO links (link_id, link) VALUES (%d, '%s')" % (link_id, link))
-        return link_id
+        else:
+            self.dbh().execute("INSERT IGNORE INTO links (link_id, link) VALUES (%d, '%s')" % (link_id, link))
+        link_id = self.dbh().get_insert_id() or self.get_link_id(link)
+        return self.interner('links').add(link, link_id)
 
     def is_unique(self, sense1_id, sense2_id):
-        self.dbh().execute("INSERT IGNORE INTO directed_edges VALUES (%d, %d)" %
-                           (sense1_id, sense2_id))
-        if not self.dbh().get_row_cnt():
-            return False
-        if not self.is_directed():
-            self.dbh().execute("INSERT IGNORE INTO directed_edges VALUES (%d, %d)" %
-                               (sense2_id, sense1_id))
-            if not self.dbh().get_row_cnt():
-                return False
-        return True
+        return self.edge_set().add(sense1_id, sense2_id)
 
     def get_gpickle_path(self):
         return "%s.gpickle" % self.dbname
@@ -242,48 +381,205 @@ class Database(object):
     def graph(self, read_gpickle=False, write_gpickle=False):
         if self.graph_ is None:
             if read_gpickle:
-                print "NOTE: Reading graph pickle file:", self.get_gpickle_path()
-                self.graph_ = nx.read_gpickle(self.get_gpickle_path())
+                with nt.Tools.phase("Reading graph pickle file: %s" % (self.get_gpickle_path())):
+                    self.graph_ = nx.read_gpickle(self.get_gpickle_path())
             else:
                 self.graph_ = nx.Graph() if not self.is_directed() else nx.DiGraph()
 
-                print "NOTE: Building Graph from Edges"
-                self.graph_.add_edges_from(self.get_edges(), bigrams=[])
+                with nt.Tools.phase("Building Graph and Edge 'bigrams' lists from Edges"):
+                    for word1_id, word2_id, bigram_id, sense1_id, sense2_id, link_id, relation_id in self.stream_edges_with_id():
+                        if self.graph_.has_edge(word1_id, word2_id):
+                            self.graph_[word1_id][word2_id]['bigrams'].append(bigram_id)
+                        else:
+                            self.graph_.add_edge(word1_id, word2_id, bigrams=[bigram_id], senses=(word1_id, sense1_id, sense2_id), link_id=link_id)
 
-                print "NOTE: Initializing Edge 'bigrams' list"
-                for edge in self.get_edges_with_id():
-                    self.graph_[edge[0]][edge[1]]['bigrams'] = []
+                with nt.Tools.phase("Removing sub-components"):
+                    comp_list = nx.connected_components(self.graph_)
+                    comp_len = [len(comp) for comp in comp_list]
+                    comp_len.sort()
+                    max_len = comp_len[-1]
 
-                print "NOTE: Building Edge 'bigrams' list"
-                for edge in self.get_edges_with_id():
-                    self.graph_[edge[0]][edge[1]]['bigrams'].append(edge[2])
-
-                print "NOTE: Removing sub-components"
-                comp_list = nx.connected_components(self.graph_)
-                comp_len = [len(comp) for comp in comp_list]
-                comp_len.sort()
-                max_len = comp_len[-1]
-
-                for comp in comp_list:
-                    if len(comp) < max_len:
-                        self.graph_.remove_nodes_from(comp)
+                    for comp in comp_list:
+                        if len(comp) < max_len:
+                            self.graph_.remove_nodes_from(comp)
 
             assert(len(nx.connected_components(self.graph_)) == 1)
 
             if write_gpickle:
-                print "NOTE: Writing graph pickle file:", self.get_gpickle_path()
-                nx.write_gpickle(self.graph_, self.get_gpickle_path())
+                with nt.Tools.phase("Writing graph pickle file: %s" % (self.get_gpickle_path())):
+                    nx.write_gpickle(self.graph_, self.get_gpickle_path())
 
         return self.graph_
 
-    def is_sense_pair(self, word_id, sense_id):
-        return self.dbh().get_one("SELECT count(*) FROM senses WHERE sense_id=%d AND word_id=%d" % (sense_id, word_id))
+    def get_snapshot_path(self):
+        return "%s.snapshot" % self.dbname
+
+    def fingerprint(self):
+        """
+        Returns: String identifying the contents of the tables the graph is built from
+        """
+        return "%s:%s" % (self.dbname, ','.join([str(val) for val in self.dbh().get_row(
+            "SELECT (SELECT COUNT(*) FROM bigrams), (SELECT MAX(bigram_id) FROM bigrams), (SELECT COUNT(*) FROM senses), (SELECT MAX(sense_id) FROM senses), (SELECT COUNT(*) FROM words), (SELECT MAX(word_id) FROM words)")]))
+
+    def read_snapshot(self):
+        """
+        Returns: Graph.CSR_Graph mapped from the snapshot file, or None if it is missing, invalid
+        or was not built from the current contents of the database
+        """
+        try:
+            with nt.Tools.phase("Mapping graph snapshot file: %s" % (self.get_snapshot_path())):
+                graph = Graph.CSR_Graph.load(self.get_snapshot_path(), verify=self.verify_snapshots)
+        except (IOError, ValueError, Graph.SnapshotError) as exc:
+            warnings.warn("Could not read graph snapshot: %s" % (exc))
+            return None
+        if graph.meta.get('fingerprint') != self.fingerprint():
+            warnings.warn("Graph snapshot %s does not match database '%s'" % (self.get_snapshot_path(), self.dbname))
+            return None
+        if graph.lexicon is None or not graph.has_payload():
+            warnings.warn("Graph snapshot %s has no lexicon or edge payload" % (self.get_snapshot_path()))
+            return None
+        self.lexicon_ = graph.lexicon
+        return graph
+
+    def lexicon(self):
+        """
+        Returns: Graph.Lexicon of every word in the words table, read in one streamed pass
+        """
+        if self.lexicon_ is None:
+            with nt.Tools.phase("Reading Words"):
+                self.lexicon_ = Graph.Lexicon.from_words(self.dbh().stream_all("SELECT word_id, word FROM words"))
+        return self.lexicon_
+
+    def csr_graph(self, read_snapshot=False, write_snapshot=False):
+        """
+        Returns: Graph.CSR_Graph of the largest connected component, mapped from the snapshot
+        file when read_snapshot is set and it matches the database, otherwise built from one
+        streamed pass over the edges
+        """
+        if self.csr_graph_ is None and read_snapshot:
+            self.csr_graph_ = self.read_snapshot()
+
+        if self.csr_graph_ is None:
+            assert(not self.is_directed())
+            columns = [array.array('I') for ii in range(7)]
+
+            with nt.Tools.phase("Reading Edges"):
+                for row in self.stream_edges_with_id():
+                    for column, val in zip(columns, row):
+                        column.append(val)
+
+            with nt.Tools.phase("Building CSR Graph"):
+                word1_ids, word2_ids, bigram_ids, sense1_ids, sense2_ids, link_ids, relation_ids = [np.frombuffer(column, dtype=np.uint32) for column in columns]
+                bigram_data = np.zeros(len(bigram_ids), dtype=Graph.CSR_Graph.EDGE_DTYPE)
+                bigram_data['sense1_id'] = sense1_ids
+                bigram_data['sense2_id'] = sense2_ids
+                bigram_data['link_id'] = link_ids
+                bigram_data['relation_id'] = relation_ids
+                self.csr_graph_ = Graph.CSR_Graph.from_edges(word1_ids, word2_ids, bigram_ids, bigram_data=bigram_data, link_names=self.link_name_table())
+            self.csr_graph_.lexicon = self.lexicon()
+
+            if write_snapshot:
+                with nt.Tools.phase("Writing graph snapshot file: %s" % (self.get_snapshot_path())):
+                    self.csr_graph_.save(self.get_snapshot_path(), meta={'fingerprint': self.fingerprint()})
+        return self.csr_graph_
+
+    def get_landmarks_path(self):
+        return "%s.landmarks" % self.dbname
+
+    def landmarks(self, graph, num_landmarks, write_snapshot=False):
+        """
+        Returns: Graph.Landmarks distance oracle for graph, read from the landmarks file when it
+        matches the database and num_landmarks, otherwise built and, with write_snapshot, saved
+        """
+        try:
+            landmarks = Graph.Landmarks.load(graph, self.get_landmarks_path(), verify=self.verify_snapshots)
+            if landmarks.meta.get('fingerprint') == self.fingerprint() and len(landmarks.landmark_ids) == num_landmarks:
+                return landmarks
+        except (IOError, ValueError, Graph.SnapshotError):
+            pass
+
+        with nt.Tools.phase("Building %d landmark distance arrays" % (num_landmarks)):
+            landmarks = Graph.Landmarks.build(graph, num_landmarks=num_landmarks)
+
+        if write_snapshot:
+            with nt.Tools.phase("Writing landmarks file: %s" % (self.get_landmarks_path())):
+                landmarks.save(self.get_landmarks_path(), meta={'fingerprint': self.fingerprint()})
+        return landmarks
+
+    def get_pair_index_path(self):
+        return "%s.pairs" % self.dbname
+
+    def read_pair_index(self):
+        """
+        Returns: Graph.Pair_Index mapped from the pair index file, or None if it is missing, invalid
+        or was not built from the current contents of the database
+        """
+        try:
+            index = Graph.Pair_Index.load(self.get_pair_index_path(), verify=self.verify_snapshots)
+        except (IOError, ValueError, Graph.SnapshotError) as exc:
+            warnings.warn("Could not read pair index: %s" % (exc))
+            return None
+        if index.meta.get('fingerprint') != self.fingerprint():
+            warnings.warn("Pair index %s does not match database '%s'" % (self.get_pair_index_path(), self.dbname))
+            return None
+        return index
+
+    def pair_index(self, graph, num_sources, pairs_per_distance=4, workers=None, seed=0, max_searches=None):
+        """
+        Returns: Graph.Pair_Index of graph refreshed from the pair index file and written back. Only
+        sources that are new or were searched on an older graph are searched, at most max_searches.
+        """
+        try:
+            index = Graph.Pair_Index.load(self.get_pair_index_path(), verify=self.verify_snapshots)
+        except (IOError, ValueError, Graph.SnapshotError):
+            index = Graph.Pair_Index.empty()
+        stale = index.meta.get('fingerprint') != self.fingerprint() or index.meta.get('pairs_per_distance') != pairs_per_distance
 
-    def get_bigram(self, bigram_id):
-        return self.dbh().get_row_assoc("SELECT * FROM bigrams JOIN links USING (link_id) WHERE bigram_id=%d" % (bigram_id))
+        with nt.Tools.phase("Searching pair index sources"):
+            index = index.refresh(graph, num_sources, pairs_per_distance=pairs_per_distance, workers=workers, seed=seed, stale=stale,
+                                  max_searches=max_searches)
+        print "NOTE: %d pairs from %d sources, %d stale sources left" % (len(index.heads), len(index.sources), len(index.stale))
+
+        with nt.Tools.phase("Writing pair index file: %s" % (self.get_pair_index_path())):
+            index.save(self.get_pair_index_path(), meta={'fingerprint': self.fingerprint(), 'pairs_per_distance': pairs_per_distance})
+        return index
+
+    def get_glosses_path(self):
+        return "%s.glosses" % self.dbname
+
+    def gloss_store(self, write_snapshot=False):
+        """
+        Returns: Graph.Gloss_Store of every sense, read from the glosses file when it matches the
+        database, otherwise built from one streamed pass and, with write_snapshot, saved
+        """
+        try:
+            with nt.Tools.phase("Mapping glosses file: %s" % (self.get_glosses_path())):
+                store = Graph.Gloss_Store.load(self.get_glosses_path(), verify=self.verify_snapshots)
+            if store.meta.get('fingerprint') == self.fingerprint():
+                return store
+            warnings.warn("Glosses file %s does not match database '%s'" % (self.get_glosses_path(), self.dbname))
+        except (IOError, ValueError, Graph.SnapshotError) as exc:
+            warnings.warn("Could not read glosses file: %s" % (exc))
+
+        with nt.Tools.phase("Reading Glosses"):
+            store = Graph.Gloss_Store.from_glosses(self.stream_glosses())
+        print "NOTE: %d senses, %d distinct glosses" % (len(store), len(store.offsets) - 1)
+
+        if write_snapshot:
+            with nt.Tools.phase("Writing glosses file: %s" % (self.get_glosses_path())):
+                store.save(self.get_glosses_path(), meta={'fingerprint': self.fingerprint()})
+        return store
+
+    def stream_glosses(self):
+        """
+        Generator of (sense_id, gloss) for every sense, from one get_gloss query per sense.
+        Databases override it with a single streamed join.
+        """
+        for sense_id in self.dbh().stream_all("SELECT sense_id FROM senses"):
+            yield sense_id[0], self.get_gloss(sense_id[0])
 
     def get_word_id(self, word):
-        return self.dbh().get_one("SELECT word_id FROM words WHERE word='%s'" % (word))
+        return self.dbh().get_one("SELECT word_id FROM words WHERE word='%s'" % (self.dbh().escape_string(word)))
 
     def get_word_from_sense_id(self, sense_id):
         return self.dbh().get_one("SELECT word FROM words JOIN senses USING (word_id) WHERE sense_id=%d" % (sense_id))
@@ -291,6 +587,35 @@ class Database(object):
     def get_word(self, word_id):
         return self.dbh().get_one("SELECT word FROM words WHERE word_id=%d" % (word_id))
 
+    def id_list(self, ids):
+        return ','.join(["%d" % (id) for id in set(ids)])
+
+    def get_bigrams(self, bigram_ids):
+        """
+        Returns: {bigram_id: bigram} for bigram_ids, joined with their links, fetched in one query
+        """
+        if not bigram_ids:
+            return {}
+        return dict([(bigram['bigram_id'], bigram) for bigram in
+                     self.dbh().get_all_assoc("SELECT * FROM bigrams JOIN links USING (link_id) WHERE bigram_id IN (%s)" % (self.id_list(bigram_ids)))])
+
+    def get_senses(self, sense_ids):
+        """
+        Returns: {sense_id: sense} for sense_ids, fetched in one query
+        """
+        if not sense_ids:
+            return {}
+        return dict([(sense['sense_id'], sense) for sense in
+                     self.dbh().get_all_assoc("SELECT * FROM senses WHERE sense_id IN (%s)" % (self.id_list(sense_ids)))])
+
+    def get_glosses(self, sense_ids, senses=None):
+        """
+        Returns: {sense_id: gloss} for sense_ids, from one get_gloss query per sense. Databases
+        override it with a single IN (...) query, to which senses may pass the sense rows already
+        fetched; it is ignored here.
+        """
+        return dict([(sense_id, self.get_gloss(sense_id)) for sense_id in set(sense_ids)])
+
     def get_link_id(self, link):
         return self.dbh().get_one("SELECT link_id FROM links WHERE link='%s'" % (link))
 
@@ -300,11 +625,27 @@ class Database(object):
     def get_word_ids(self):
         return self.dbh().get_list("SELECT word_id FROM words")
 
-    def get_edges(self):
-        return self.dbh().get_all("SELECT w0.word_id, w1.word_id FROM bigrams JOIN senses s0 ON (sense1_id=s0.sense_id) JOIN senses s1 ON (sense2_id=s1.sense_id) JOIN words w0 ON (w0.word_id=s0.word_id) JOIN words w1 ON (w1.word_id=s1.word_id)")
+    def stream_edges_with_id(self):
+        """
+        Generator of (word1_id, word2_id, bigram_id, sense1_id, sense2_id, link_id, relation_id) for every bigram
+        """
+        return self.dbh().stream_all("SELECT w0.word_id, w1.word_id, bigram_id, sense1_id, sense2_id, link_id, relation_id FROM bigrams JOIN senses s0 ON (sense1_id=s0.sense_id) JOIN senses s1 ON (sense2_id=s1.sense_id) JOIN words w0 ON (w0.word_id=s0.word_id) JOIN words w1 ON (w1.word_id=s1.word_id) ORDER BY bigram_id")
 
-    def get_edges_with_id(self):
-        return self.dbh().get_all("SELECT w0.word_id, w1.word_id, bigram_id FROM bigrams JOIN senses s0 ON (sense1_id=s0.sense_id) JOIN senses s1 ON (sense2_id=s1.sense_id) JOIN words w0 ON (w0.word_id=s0.word_id) JOIN words w1 ON (w1.word_id=s1.word_id)")
+    def get_link_names(self):
+        """
+        Returns: {link_id: link} for every link
+        """
+        return self.dbh().get_dict("SELECT link_id, link FROM links")
+
+    def link_name_table(self):
+        """
+        Returns: Array of link names indexed by link_id
+        """
+        names = self.get_link_names()
+        table = [''] * (max(names.keys() + [0]) + 1)
+        for link_id, link in names.items():
+            table[link_id] = link
+        return np.array(table, dtype='S%d' % (max([len(link) for link in table] + [1])))
 
     def get_attribute(self, attribute):
         return self.dbh().get_one("SELECT value FROM config WHERE attribute='%s'" % (attribute))
@@ -314,6 +655,209 @@ class Database(object):
             self.is_directed_ = self.dbh().get_one("SELECT value FROM config WHERE attribute='directed'") == 'True'
         return self.is_directed_
 
+class Interner(object):
+    """
+    Per-ingest string to id cache for the words, links or relations table. It is
+    preloaded from the existing rows so that each distinct string costs one write
+    and repeats are answered without querying the database.
+    """
+
+    TABLES = {'words': ('word_id', 'word'),
+              'links': ('link_id', 'link'),
+              'relations': ('relation_id', 'relation')}
+
+    def __init__(self, db, tbl, id_fld, name_fld):
+        self.db = db
+        self.tbl = tbl
+        self.id_fld = id_fld
+        self.name_fld = name_fld
+        self.ids_ = None
+
+    def ids(self):
+        """
+        Returns: Dict keyed by name referencing id
+        """
+        if self.ids_ is None:
+            self.ids_ = self.db.dbh().get_dict("SELECT %s, %s FROM %s" % (self.name_fld, self.id_fld, self.tbl))
+        return self.ids_
+
+    def get(self, name):
+        return self.ids().get(name)
+
+    def add(self, name, id):
+        self.ids()[name] = id
+        return id
+
+    def __contains__(self, name):
+        return name in self.ids()
+
+    def __len__(self):
+        return len(self.ids())
+
+class Edge_Set(object):
+    """
+    In-memory set of (sense1_id, sense2_id) pairs seen during ingestion, packed into
+    single integer keys. Replaces the directed_edges round trips of Database.is_unique;
+    the pairs added since the last pop_new_pairs() are kept for a single bulk write.
+    """
+
+    SHIFT = 32
+
+    def __init__(self, directed):
+        self.directed = directed
+        self.keys_ = set()
+        self.new_keys_ = []
+
+    def key(self, sense1_id, sense2_id):
+        return (sense1_id << self.SHIFT) | sense2_id
+
+    def pair(self, key):
+        return (key >> self.SHIFT, key & ((1 << self.SHIFT) - 1))
+
+    def load(self, pairs):
+        for sense1_id, sense2_id in pairs:
+            self.keys_.add(self.key(sense1_id, sense2_id))
+
+    def add(self, sense1_id, sense2_id):
+        """
+        Returns: True if the edge was not seen before (in either direction for undirected edges)
+        """
+        keys = [self.key(sense1_id, sense2_id)]
+        if not self.directed:
+            keys.append(self.key(sense2_id, sense1_id))
+        for key in keys:
+            if key in self.keys_:
+                return False
+        for key in keys:
+            self.keys_.add(key)
+            self.new_keys_.append(key)
+        return True
+
+    def pop_new_pairs(self):
+        pairs = [self.pair(key) for key in self.new_keys_]
+        self.new_keys_ = []
+        return pairs
+
+    def __len__(self):
+        return len(self.keys_)
+
+class Bulk_Loader(object):
+    """
+    Ingests edges without per-row round trips: word, sense and link ids are resolved
+    client-side through the database's Interner caches, duplicates are detected with
+    its Edge_Set and the words, senses, links and bigrams rows are buffered and written
+    as batched multi-row inserts or with LOAD DATA LOCAL INFILE.
+
+    The interners compare names exactly while the columns' collation does not, so a case
+    or accent variant of a known name gets an id of its own whose row the write ignores.
+    After words or links are written the ids of such rows are moved to the rows they
+    collided with, in the interner and in the senses or bigrams rows staged with them.
+    """
+
+    METHODS = ['insert', 'infile']
+
+    TABLES = [('words', ['word_id', 'word']),
+              ('senses', ['sense_id', 'word_id', 'ref_sense_id']),
+              ('links', ['link_id', 'link']),
+              ('bigrams', ['sense1_id', 'sense2_id', 'link_id', 'relation_id'])]
+
+    # table interned, and the staged table and column referencing its ids
+    REFERENCES = {'words': ('senses', 1),
+                  'links': ('bigrams', 2)}
+
+    def __init__(self, db, method=None, batch_size=50000):
+        self.db = db
+        self.method = self.METHODS[0] if method is None else method
+        self.batch_size = batch_size
+        assert(self.method in self.METHODS)
+
+        self.rows_ = dict([(tbl, []) for tbl, flds in self.TABLES])
+        self.row_cnt_ = 0
+        self.next_id_ = {}
+
+    def dbh(self):
+        return self.db.dbh()
+
+    def next_id(self, tbl, fld):
+        if not tbl in self.next_id_:
+            self.next_id_[tbl] = 1 + int(self.dbh().get_one("SELECT IFNULL(MAX(%s), 0) FROM %s" % (fld, tbl)))
+            if tbl == 'senses':
+                self.next_id_[tbl] = max(self.next_id_[tbl], self.db.sense_id_first())
+        return self.next_id_[tbl]
+
+    def allocate_id(self, tbl, fld, id=None):
+        if id is None:
+            id = self.next_id(tbl, fld)
+        self.next_id_[tbl] = max(self.next_id(tbl, fld), id + 1)
+        return id
+
+    def add_row(self, tbl, row):
+        self.rows_[tbl].append(row)
+        self.row_cnt_ += 1
+        if self.row_cnt_ >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        for tbl, flds in self.TABLES:
+            if len(self.rows_[tbl]):
+                if self.method == 'infile':
+                    self.dbh().load_rows(tbl, flds, self.rows_[tbl], ignore=True)
+                else:
+                    self.dbh().insert_rows(tbl, flds, self.rows_[tbl], ignore=True)
+                if tbl in self.REFERENCES:
+                    self.remap(tbl, self.rows_[tbl])
+                self.rows_[tbl] = []
+        self.row_cnt_ = 0
+
+    def remap(self, tbl, rows):
+        """
+        Point the ids of the (id, name) rows just written to tbl that the write ignored at the
+        rows their names collide with
+        """
+        interner = self.db.interner(tbl)
+        written = set(self.dbh().get_list("SELECT %s FROM %s WHERE %s IN (%s)" % (interner.id_fld, tbl, interner.id_fld, self.db.id_list([id for id, name in rows]))))
+        ids = {}
+        for id, name in rows:
+            if not id in written:
+                ids[id] = interner.add(name, self.dbh().get_one("SELECT %s FROM %s WHERE %s='%s'" % (interner.id_fld, tbl, interner.name_fld, self.dbh().escape_string(name))))
+        if ids:
+            ref_tbl, fld = self.REFERENCES[tbl]
+            self.rows_[ref_tbl] = [row[:fld] + (ids.get(row[fld], row[fld]),) + row[fld + 1:] for row in self.rows_[ref_tbl]]
+
+    def intern(self, tbl, id, name):
+        interner = self.db.interner(tbl)
+        if name in interner:
+            return interner.get(name)
+        self.add_row(tbl, (interner.add(name, self.allocate_id(tbl, interner.id_fld, id)), name))
+        # the row may have been written and its id moved by a flush already
+        return interner.get(name)
+
+    def insert_word(self, word_id, word):
+        return self.intern('words', word_id, word)
+
+    def insert_link(self, link_id, link):
+        return self.intern('links', link_id, link)
+
+    def insert_sense(self, sense_id, word_id, ref_sense_id):
+        if not sense_id is None and sense_id in self.db.sense_ids():
+            return sense_id
+        sense_id = self.allocate_id('senses', 'sense_id', sense_id)
+        self.db.sense_ids().add(sense_id)
+        self.add_row('senses', (sense_id, word_id, ref_sense_id))
+        return sense_id
+
+    def insert_bigram(self, edge):
+        sense_id = {}
+        for num in [1, 2]:
+            word_id = self.insert_word(edge[word_id_fld(num)], edge[word_fld(num)])
+            sense_id[num] = self.insert_sense(edge[sense_id_fld(num)], word_id, edge['ref_sense_id'] if 'ref_sense_id' in edge else None)
+
+        link_id = self.insert_link(edge['link_id'], edge['link'])
+        if self.db.is_unique(sense_id[1], sense_id[2]):
+            self.add_row('bigrams', (sense_id[1], sense_id[2], link_id, edge['relation_id']))
+            return 1
+        return 0
+
 class WordNet_Database(Database):
 
     RELATIONS = ['semantic', 'lexical', 'synonym', 'collocation']
@@ -324,9 +868,9 @@ class WordNet_Database(Database):
         self.dst_dbname = dst_dbname
         self.tmp_valid_unigrams_ = None
 
-    def create_db(self):
+    def create_db(self, bulk=None, directed_edges=True, workers=None):
         super(WordNet_Database, self).create_db(classname=self.__class__.__name__, src_dbname=self.src_dbname)
-        self.insert_relations(self.RELATIONS)
+        self.insert_relations(self.RELATIONS, bulk=bulk, directed_edges=directed_edges, workers=workers)
 
     def tmp_valid_unigrams(self):
         if self.tmp_valid_unigrams_ is None:
@@ -337,36 +881,49 @@ class WordNet_Database(Database):
                                (self.tmp_valid_unigrams_, self.src_dbname))
         return self.tmp_valid_unigrams_
 
-    def get_src_word_id(self, word):
-        return self.dbh().get_one("SELECT wordid FROM %s.words WHERE lemma='%s'" % (self.src_dbname, word))
-        
-    def get_src_sense_id(self, word):
-        return self.dbh().get_one("SELECT senseid FROM %s.words JOIN %s.senses USING (wordid) WHERE lemma='%s'" % (self.src_dbname, self.src_dbname, word))
-        
-    def is_casedword(self, word):
-        return self.dbh().get_one("SELECT NOT casedwordid IS NULL FROM %s.words JOIN %s.senses USING (wordid) WHERE lemma='%s'" % (self.src_dbname, self.src_dbname, word))
-
     def sense_id_first(self):
         if self.sense_id_first_ is None:
             self.sense_id_first_ = 1 + self.dbh().get_one("SELECT MAX(senseid) FROM %s.senses" % (self.src_dbname))
         return self.sense_id_first_
             
-    def insert_relations(self, relations):
-
+    def insert_relations(self, relations, bulk=None, directed_edges=True, workers=None):
+        """
+        Insert the edges of each relation. With more than one worker, the edges of the relations are
+        extracted concurrently by a pool of processes, each with its own connection, and
+        staged to temporary files that are merged here one relation at a time so ids are
+        resolved by a single writer.
+        """
+        relation_ids = []
         for relation in relations:
             assert(relation in self.RELATIONS)
 
             relation_id = self.remove_relations(relation)
             if relation_id is None:
                 relation_id = self.insert_relation(None, relation)
+            relation_ids.append(relation_id)
 
-            print "INSERT_RELATIONS: ", relation
-            self.insert_into_db(self.get_src_edges(relation_id, relation))
+        if workers is None or min(workers, len(relations)) <= 1:
+            for relation_id, relation in zip(relation_ids, relations):
+                print "INSERT_RELATIONS: ", relation
+                self.insert_into_db(self.get_src_edges(relation_id, relation), bulk=bulk, directed_edges=directed_edges)
+            return
+
+        pool = multiprocessing.Pool(min(workers, len(relations)))
+        try:
+            paths = pool.imap(stage_relation_edges,
+                              [(self.src_dbname, self.dst_dbname, self.tmp_valid_unigrams(), relation_id, relation)
+                               for relation_id, relation in zip(relation_ids, relations)])
+            for relation, path in zip(relations, paths):
+                print "INSERT_RELATIONS: ", relation
+                self.insert_into_db(read_staged_edges(path), bulk=bulk, directed_edges=directed_edges)
+        finally:
+            pool.close()
+            pool.join()
 
     def get_src_edges(self, relation_id, relation):
 
         if relation == 'semantic' or relation == 'lexical':
-            return [edge for edge in self.dbh().get_all_assoc(
+            return self.dbh().stream_assoc(
                 "SELECT \
                 ss.wordid as word1_id, \
                 sw.word as word1, \
@@ -387,53 +944,88 @@ class WordNet_Database(Database):
                 ss.casedwordid IS NULL \
                 AND \
                 ds.casedwordid IS NULL \
-                ")]
-
-        edges = []
+                ")
 
         if relation == 'synonym':
-            for synsetid in self.dbh().get_list("SELECT synsetid FROM %s.synsets" % (self.src_dbname)):
-                synset = self.dbh().get_all_assoc("SELECT * FROM %s.senses JOIN %s w ON (wordid=w.word_id) WHERE synsetid=%d AND casedwordid is NULL" % (self.src_dbname, self.tmp_valid_unigrams(), synsetid))
-                for ii in range(len(synset) - 1):
-                    for jj in range(ii + 1, len(synset)):
-                        edges.append({
-                            'word1_id': synset[ii]['wordid'],
-                            'word1': synset[ii]['word'],
-                            'sense1_id': synset[ii]['senseid'],
-                            'word2_id': synset[jj]['wordid'],
-                            'word2': synset[jj]['word'],
-                            'sense2_id': synset[jj]['senseid'],
-                            'link_id': None,
-                            'link': relation,
-                            'relation_id': relation_id
-                            })
+            return self.get_src_synonym_edges(relation_id, relation)
 
         if relation == 'collocation':
-            for collocation in self.dbh().get_all_assoc(
-                "SELECT lemma, \
-                SUBSTRING_INDEX(REPLACE(lemma, '-', ' '), ' ',1) AS word1, \
-                SUBSTRING_INDEX(REPLACE(lemma, '-', ' '), ' ',-1) AS word2 \
-                FROM %s.words \
-                WHERE lemma REGEXP '^[[:alpha:]]* [[:alpha:]]*$'"
-                % (self.src_dbname)):
-
-                cased1 = self.is_casedword(collocation['word1'])
-                cased2 = self.is_casedword(collocation['word2'])
-
-                if not (cased1 or cased2 or cased1 is None or cased2 is None):
-                    edges.append({
-                        'word1_id': self.get_src_word_id(collocation['word1']),
-                        'word1': collocation['word1'],
-                        'sense1_id': None,
-                        'word2_id': self.get_src_word_id(collocation['word2']),
-                        'word2': collocation['word2'],
-                        'sense2_id': None,
-                        'ref_sense_id': self.get_src_sense_id(collocation['lemma']),
+            return self.get_src_collocation_edges(relation_id, relation)
+
+        return []
+
+    def get_src_synonym_edges(self, relation_id, relation):
+        """
+        Returns: Generator of edges linking every pair of senses within a synset, streamed from a
+        single scan of the senses ordered by synsetid
+        """
+        return self.pair_synset_senses(self.dbh().stream_assoc(
+            "SELECT synsetid, wordid, word, senseid FROM %s.senses JOIN %s w ON (wordid=w.word_id) WHERE casedwordid IS NULL ORDER BY synsetid, senseid"
+            % (self.src_dbname, self.tmp_valid_unigrams())), relation_id, relation)
+
+    def pair_synset_senses(self, senses, relation_id, relation):
+        for synsetid, synset in itertools.groupby(senses, lambda sense: sense['synsetid']):
+            synset = list(synset)
+            for ii in range(len(synset) - 1):
+                for jj in range(ii + 1, len(synset)):
+                    yield {
+                        'word1_id': synset[ii]['wordid'],
+                        'word1': synset[ii]['word'],
+                        'sense1_id': synset[ii]['senseid'],
+                        'word2_id': synset[jj]['wordid'],
+                        'word2': synset[jj]['word'],
+                        'sense2_id': synset[jj]['senseid'],
                         'link_id': None,
                         'link': relation,
                         'relation_id': relation_id
-                        })
-        return edges
+                        }
+
+    def get_src_lemmas(self):
+        """
+        Returns: Dict keyed by lemma referencing {'wordid': <wordid>, 'cased': <cased>, 'senseid': <senseid>}
+        for the lowest senseid of each lemma, loaded with a single join
+        """
+        lemmas = {}
+        for sense in self.dbh().stream_assoc(
+            "SELECT lemma, wordid, senseid, NOT casedwordid IS NULL AS cased FROM %s.words JOIN %s.senses USING (wordid) ORDER BY wordid, senseid"
+            % (self.src_dbname, self.src_dbname)):
+            if not sense['lemma'] in lemmas:
+                lemmas[sense['lemma']] = sense
+        return lemmas
+
+    def get_src_collocation_edges(self, relation_id, relation):
+        """
+        Returns: Generator of edges linking the two words of each two word collocation, resolved
+        in memory against get_src_lemmas() rather than with per-collocation lookups
+        """
+        return self.resolve_collocations(self.get_src_lemmas(), self.dbh().stream_assoc(
+            "SELECT lemma, \
+            SUBSTRING_INDEX(REPLACE(lemma, '-', ' '), ' ',1) AS word1, \
+            SUBSTRING_INDEX(REPLACE(lemma, '-', ' '), ' ',-1) AS word2 \
+            FROM %s.words \
+            WHERE lemma REGEXP '^[[:alpha:]]* [[:alpha:]]*$'"
+            % (self.src_dbname)), relation_id, relation)
+
+    def resolve_collocations(self, lemmas, collocations, relation_id, relation):
+        for collocation in collocations:
+            lemma1 = lemmas.get(collocation['word1'])
+            lemma2 = lemmas.get(collocation['word2'])
+
+            if lemma1 is None or lemma2 is None or lemma1['cased'] or lemma2['cased']:
+                continue
+
+            yield {
+                'word1_id': lemma1['wordid'],
+                'word1': collocation['word1'],
+                'sense1_id': None,
+                'word2_id': lemma2['wordid'],
+                'word2': collocation['word2'],
+                'sense2_id': None,
+                'ref_sense_id': lemmas[collocation['lemma']]['senseid'] if collocation['lemma'] in lemmas else None,
+                'link_id': None,
+                'link': relation,
+                'relation_id': relation_id
+                }
 
     def is_directed(self):
         return False
@@ -449,6 +1041,24 @@ class WordNet_Database(Database):
         return self.dbh().get_one("SELECT definition FROM %s.synsets JOIN %s.senses USING (synsetid) WHERE senseid=%d" %
                                   (self.src_dbname, self.src_dbname, ref_sense_id))
 
+    def get_glosses(self, sense_ids, senses=None):
+        if not sense_ids:
+            return {}
+        if senses is None:
+            senses = self.get_senses(sense_ids)
+        ref_sense_ids = {}
+        for sense_id in set(sense_ids):
+            ref_sense_id = senses[sense_id]['ref_sense_id'] if sense_id in senses else None
+            ref_sense_ids[sense_id] = sense_id if ref_sense_id is None else ref_sense_id
+        definitions = self.dbh().get_dict("SELECT senseid, definition FROM %s.synsets JOIN %s.senses USING (synsetid) WHERE senseid IN (%s)" %
+                                          (self.src_dbname, self.src_dbname, self.id_list(ref_sense_ids.values())))
+        return dict([(sense_id, definitions.get(ref_sense_id)) for sense_id, ref_sense_id in ref_sense_ids.items()])
+
+    def stream_glosses(self):
+        return self.dbh().stream_all("SELECT s.sense_id, sy.definition FROM senses s " +
+                                     "LEFT JOIN %s.senses ss ON (ss.senseid=IFNULL(s.ref_sense_id, s.sense_id)) " % (self.src_dbname) +
+                                     "LEFT JOIN %s.synsets sy ON (sy.synsetid=ss.synsetid)" % (self.src_dbname))
+
 class Grid_Database(Database):
 
     def __init__(self, dbname, row_str, col_str, cut_str=None):
@@ -462,13 +1072,13 @@ class Grid_Database(Database):
         self.row_step_ = None
         self.col_step_ = None
 
-    def create_db(self):
+    def create_db(self, bulk=None, directed_edges=True):
         self.cut(self.cut_str)
         super(Grid_Database, self).create_db(classname=self.__class__.__name__,
                                              row_str=self.row_str,
                                              col_str=self.col_str,
                                              directed=False)
-        self.insert_into_db()
+        self.insert_into_db(bulk=bulk, directed_edges=directed_edges)
 
     def cut(self, cut_str):
         if cut_str is not None:
@@ -485,7 +1095,7 @@ class Grid_Database(Database):
 
     def get_src_edges(self):
         relation_id = self.insert_relation(None, 'spatial')
-        return [{
+        return ({
             'word1_id': None,
             'sense1_id': None,
             'word2_id': None,
@@ -495,7 +1105,7 @@ class Grid_Database(Database):
             'link_id': None,
             'link': 'neighbor',
             'relation_id': relation_id
-            } for edge in self.grid().edges()]
+            } for edge in self.grid().edges())
 
     def grid(self):
         if self.grid_ is None:
@@ -533,6 +1143,16 @@ class Grid_Database(Database):
         word = self.get_word_from_sense_id(sense_id)
         return "row %s, column %s" % (word[0], word[1])
 
+    def get_glosses(self, sense_ids, senses=None):
+        if not sense_ids:
+            return {}
+        words = self.dbh().get_dict("SELECT sense_id, word FROM words JOIN senses USING (word_id) WHERE sense_id IN (%s)" % (self.id_list(sense_ids)))
+        return dict([(sense_id, "row %s, column %s" % (word[0], word[1])) for sense_id, word in words.items()])
+
+    def stream_glosses(self):
+        for sense_id, word in self.dbh().stream_all("SELECT sense_id, word FROM senses JOIN words USING (word_id)"):
+            yield sense_id, "row %s, column %s" % (word[0], word[1])
+
     def __str__(self):
         lines = []
         for row1 in range(len(self.row_str)):
@@ -584,58 +1204,293 @@ class EdgeUnknownError(Error):
         self.ref2 = ref2
         super(EdgeUnknownError, self).__init__("Edge could not be determined defined by refs '%d' and '%d'" % (ref1, ref2))
 
+class Path_Cache(nt.Tools.Cache):
+    """
+    Shortest path cache keyed by (ref1, ref2). For undirected graphs the key is
+    normalized so (ref1, ref2) and (ref2, ref1) share an entry, and the stored path
+    is reversed on the way out when the request runs the other way.
+    """
+
+    def __init__(self, directed, max_entries=None, max_size=None, policy='lru'):
+        super(Path_Cache, self).__init__(max_entries=max_entries, max_size=max_size, sizeof=self.path_size, policy=policy)
+        self.directed = directed
+
+    def path_size(self, path):
+        """
+        Returns: approximate bytes held by a cached path (list header plus one pointer and int per ref)
+        """
+        return sys.getsizeof(path) + 24 * len(path)
+
+    def is_reversed(self, key):
+        return not self.directed and key[0] > key[1]
+
+    def get(self, key, default=None):
+        if self.is_reversed(key):
+            path = super(Path_Cache, self).get((key[1], key[0]), default)
+            return path[::-1] if not path is default else default
+        return super(Path_Cache, self).get(key, default)
+
+    def put(self, key, path):
+        if self.is_reversed(key):
+            super(Path_Cache, self).put((key[1], key[0]), path[::-1])
+        else:
+            super(Path_Cache, self).put(key, path)
+
 class Game_API(object):
 
-    def __init__(self, dbname, read_gpickle=False, write_gpickle=False):
+    ENGINES = ['networkx', 'csr']
+    GLOSS_MODES = ['lazy', 'store']
+
+    def __init__(self, dbname, read_gpickle=False, write_gpickle=False, engine='networkx', read_snapshot=False, write_snapshot=False, landmarks=0,
+                 path_cache_entries=100000, path_cache_size=None, path_cache_policy='lru', layer_cache_entries=100,
+                 pair_index=False, glosses='lazy', gloss_cache_entries=100000, verify_snapshot=False):
+        assert(engine in self.ENGINES)
+        assert(glosses in self.GLOSS_MODES)
         self.dbname = dbname
         self.read_gpickle = read_gpickle
         self.write_gpickle = write_gpickle
+        self.read_snapshot = read_snapshot
+        self.write_snapshot = write_snapshot
+        self.verify_snapshot = verify_snapshot
+        self.num_landmarks = landmarks
+        self.path_cache_entries = path_cache_entries
+        self.path_cache_size = path_cache_size
+        self.path_cache_policy = path_cache_policy
+        self.layer_cache_entries = layer_cache_entries
+        self.pair_index = pair_index
+        self.glosses = glosses
+        self.gloss_cache_entries = gloss_cache_entries
+        self.engine = 'csr' if read_snapshot or write_snapshot or landmarks else engine
         self.db_ = None
         self.seeded_ = None
         self.paths_ = None
+        self.layers_ = None
         self.graph_ = None
+        self.landmarks_ = None
+        self.pair_index_ = None
+        self.node_ids_ = None
+        self.lexicon_ = None
+        self.gloss_store_ = None
+        self.gloss_cache_ = None
+        self.link_names_ = None
+        self.graph_version_ = None
+        self.num_components_ = None
 
     def get_gpickle_path(self):
         return "%s.gpickle" % self.dbname
 
     def _graph(self):
         if self.graph_ is None:
-            if self.read_gpickle:
+            if self.engine == 'csr':
+                self.graph_ = self._db().csr_graph(read_snapshot=self.read_snapshot, write_snapshot=self.write_snapshot)
+            elif self.read_gpickle:
                 self.graph_ = nx.read_gpickle(self.get_gpickle_path())
             else:
                 self.graph_= self._db().graph(read_gpickle=self.read_gpickle, write_gpickle=self.write_gpickle)
         return self.graph_
 
+    def graph_version(self):
+        """
+        Returns: Hex fingerprint of the graph's edges, the first bigram on each edge and the words,
+        which changes whenever a graph built from different data could answer a query differently.
+        A csr graph mapped from or written to a snapshot reuses the snapshot's checksum, which
+        covers its lexicon too; any other graph is hashed once.
+        """
+        if self.graph_version_ is None:
+            if self.engine == 'csr' and 'checksum' in self._graph().meta:
+                self.graph_version_ = '%08x' % (self._graph().meta['checksum'])
+                return self.graph_version_
+            if self.engine == 'csr':
+                checksum = self._graph().fingerprint()
+            else:
+                edges = []
+                for ref1, ref2, data in self._graph().edges_iter(data=True):
+                    if not self._graph().is_directed() and ref2 < ref1:
+                        ref1, ref2 = ref2, ref1
+                    edges.append((ref1, ref2, data['bigrams'][0]))
+                edges = np.array(edges, dtype=np.int64).reshape(-1, 3)
+                edges = edges[np.lexsort(edges.T[::-1])]
+                checksum = zlib.crc32(edges.tobytes()) & 0xffffffff
+            self.graph_version_ = '%08x%08x' % (checksum, self._lexicon().fingerprint())
+        return self.graph_version_
+
+    def _landmarks(self):
+        if self.landmarks_ is None:
+            self.landmarks_ = self._db().landmarks(self._graph(), self.num_landmarks, write_snapshot=self.write_snapshot)
+        return self.landmarks_
+
+    def _node_ids(self):
+        """
+        Returns: Array of the refs of every node, built once per graph
+        """
+        if self.node_ids_ is None:
+            if self.engine == 'csr':
+                self.node_ids_ = self._graph().nodes()
+            else:
+                self.node_ids_ = np.array(self._graph().nodes(), dtype=np.uint32)
+        return self.node_ids_
+
+    def _lexicon(self):
+        if self.lexicon_ is None:
+            if self.engine == 'csr':
+                self.lexicon_ = self._graph().lexicon
+            else:
+                self.lexicon_ = self._db().lexicon()
+        return self.lexicon_
+
+    def _gloss_store(self):
+        if self.gloss_store_ is None:
+            self.gloss_store_ = self._db().gloss_store(write_snapshot=self.write_snapshot)
+        return self.gloss_store_
+
+    def _gloss_cache(self):
+        if self.gloss_cache_ is None:
+            self.gloss_cache_ = nt.Tools.Cache(max_entries=self.gloss_cache_entries, policy=self.path_cache_policy)
+        return self.gloss_cache_
+
+    def _get_glosses(self, sense_ids, senses=None):
+        """
+        Returns: {sense_id: gloss} from the gloss store, or in lazy mode from an LRU cache whose
+        misses are fetched from the database in one query
+        """
+        if self.glosses == 'store':
+            return self._gloss_store().get_glosses(sense_ids)
+
+        glosses = {}
+        missing = object()
+        for sense_id in set(sense_ids):
+            gloss = self._gloss_cache().get(sense_id, missing)
+            if not gloss is missing:
+                glosses[sense_id] = gloss
+        fetched = self._db().get_glosses([sense_id for sense_id in set(sense_ids) if not sense_id in glosses], senses=senses)
+        for sense_id, gloss in fetched.items():
+            self._gloss_cache().put(sense_id, gloss)
+        glosses.update(fetched)
+        return glosses
+
+    def _random(self, seed=None):
+        """
+        Returns: random.Random seeded with seed, or the module's generator if seed is None
+        """
+        if seed is None:
+            self._seed()
+            return random
+        return random.Random(seed)
+
+    def _pair_index(self):
+        if self.pair_index_ is None:
+            self.pair_index_ = self._db().read_pair_index()
+            if self.pair_index_ is None:
+                self.pair_index_ = Graph.Pair_Index.empty()
+        return self.pair_index_
+
     def _db(self):
         if self.db_ is None:
             self.db_ = get_database(self.dbname)
+            self.db_.verify_snapshots = self.verify_snapshot
         return self.db_
 
+    def _paths(self):
+        if self.paths_ is None:
+            self.paths_ = Path_Cache(self._db().is_directed(), max_entries=self.path_cache_entries, max_size=self.path_cache_size,
+                                     policy=self.path_cache_policy)
+        return self.paths_
+
+    def _layers(self):
+        if self.layers_ is None:
+            self.layers_ = nt.Tools.Cache(max_entries=self.layer_cache_entries, sizeof=lambda layers: layers.nbytes(),
+                                          policy=self.path_cache_policy)
+        return self.layers_
+
     def _seed(self):
         if self.seeded_ is None:
             random.seed()
             self.seeded_ = True
             
-    def _get_bigram(self, ref0, ref1):
+    def _edge_bigrams(self, ref0, ref1):
+        if self.engine == 'csr':
+            return self._graph().bigrams(ref0, ref1)
+        return self._graph()[ref0][ref1]['bigrams']
+
+    def _connected_components(self):
+        if self.engine == 'csr':
+            return self._graph().connected_components()
+        return nx.connected_components(self._graph())
+
+    def _num_components(self):
+        if self.num_components_ is None:
+            if self.engine == 'csr':
+                self.num_components_ = self._graph().num_components()
+            else:
+                self.num_components_ = nx.number_connected_components(self._graph())
+        return self.num_components_
+
+    def _edge_bigram_id(self, ref0, ref1):
         try:
-            return self._db().get_bigram(self._graph()[ref0][ref1]['bigrams'][0])
+            return self._edge_bigrams(ref0, ref1)[0]
         except KeyError:
             raise EdgeUnknownError(ref0, ref1)
 
-    def _is_sense_pair(self, word_id, sense_id):
-        return self._db().is_sense_pair(word_id, sense_id)
+    def _link_names(self):
+        if self.link_names_ is None:
+            self.link_names_ = self._db().get_link_names()
+        return self.link_names_
 
-    def _get_gloss(self, sense_id):
-        return self._db().get_gloss(sense_id)
+    def _edge_link_senses(self, ref1, ref2):
+        """
+        Returns: (link, sense1_id, sense2_id) of the first bigram joining ref1 and ref2 from the
+        payload the graph keeps on its edges, None if it keeps none
+        """
+        try:
+            if self.engine == 'csr':
+                if not self._graph().has_payload():
+                    return None
+                return self._graph().link_senses(ref1, ref2)
+            edge = self._graph()[ref1][ref2]
+        except KeyError:
+            raise EdgeUnknownError(ref1, ref2)
+        if not 'senses' in edge:
+            return None
+        word1_id, sense1_id, sense2_id = edge['senses']
+        if word1_id != ref1:
+            sense1_id, sense2_id = sense2_id, sense1_id
+        return self._link_names()[edge['link_id']], sense1_id, sense2_id
+
+    def _link_senses(self, ref_path):
+        """
+        Returns: (link_senses, senses) where link_senses lists (link, sense1_id, sense2_id) for each
+        hop of ref_path, with sense1_id the sense of the hop's first word, read from the edge payload
+        or fetched in a constant number of queries, and senses holds the fetched sense rows or None
+        """
+        hops = zip(ref_path[:-1], ref_path[1:])
+        link_senses = [self._edge_link_senses(ref1, ref2) for ref1, ref2 in hops]
+        if not None in link_senses:
+            return link_senses, None
+
+        bigram_ids = [self._edge_bigram_id(ref1, ref2) for ref1, ref2 in hops]
+        bigrams = self._db().get_bigrams(bigram_ids)
+        for (ref1, ref2), bigram_id in zip(hops, bigram_ids):
+            if not bigram_id in bigrams:
+                raise EdgeUnknownError(ref1, ref2)
+        senses = self._db().get_senses([bigrams[bigram_id][sense_id_fld(num)] for bigram_id in bigram_ids for num in (1, 2)])
+
+        out = []
+        for ref1, bigram_id in zip(ref_path, bigram_ids):
+            bigram = bigrams[bigram_id]
+            ordered = bigram['sense1_id'] in senses and senses[bigram['sense1_id']]['word_id'] == ref1
+            sense1_id = bigram['sense1_id'] if ordered else bigram['sense2_id']
+            sense2_id = bigram['sense2_id'] if ordered else bigram['sense1_id']
+            out.append((bigram['link'], sense1_id, sense2_id))
+        return out, senses
 
     def graph_str(self):
         return str(self._db())
         
     def debug(self):
         self._graph()
-        print "Number of nodes:", len(self._graph().nodes())
-        print "Number of edges:", len(self._graph().edges())
-        comp_list = nx.connected_components(self._graph())
+        print "Number of nodes:", self._graph().order()
+        print "Number of edges:", self._graph().size()
+        comp_list = self._connected_components()
         print "Number of Connected Components:", len(comp_list)
         cnt = 1
         for refs in comp_list:
@@ -650,9 +1505,9 @@ class Game_API(object):
     def about(self):
         self._graph()
         out = {}
-        out['nodes'] = len(self._graph().nodes())
-        out['edges'] = len(self._graph().edges())
-        out['components'] = len(nx.connected_components(self._graph()))
+        out['nodes'] = self._graph().order()
+        out['edges'] = self._graph().size()
+        out['components'] = self._num_components()
         return out
 
     def sense_path(self, ref_path, include_homophones=True):
@@ -660,28 +1515,27 @@ class Game_API(object):
         List of dicts where each list item is based on linking senses of the form:
         {'word': <word>, 'index': <index>, 'link': <link>, 'gloss': <gloss>}
         """
+        link_senses, senses = self._link_senses(ref_path)
+        glosses = self._get_glosses([sense_id for link, sense1_id, sense2_id in link_senses for sense_id in (sense1_id, sense2_id)], senses=senses)
+
         out = []
         ref1 = ref_path[0]
         prev_sense1_id = 0
         out.append({'word': self.node(ref=ref1)[1], 'index': 1, 'link': None, 'gloss': 'foo'})
 
-        for ref2 in ref_path[1:]:
+        for ref2, (link, sense1_id, sense2_id) in zip(ref_path[1:], link_senses):
 
-            bigram = self._get_bigram(ref1, ref2)
-            ordered = self._is_sense_pair(ref1, bigram['sense1_id'])
-            sense1_id = bigram['sense1_id'] if ordered else bigram['sense2_id']
-            sense2_id = bigram['sense2_id'] if ordered else bigram['sense1_id']
             is_homophone = include_homophones and prev_sense1_id and (sense1_id != prev_sense1_id)
 
             if not prev_sense1_id:
-                out[-1]['gloss'] = self._get_gloss(sense1_id)
+                out[-1]['gloss'] = glosses.get(sense1_id)
 
             if is_homophone:
                 out[-1]['link'] = 'homophone'
-                out.append({'word': self.node(ref=ref1)[1], 'index': 2, 'link': None, 'gloss': self._get_gloss(sense1_id)})
+                out.append({'word': self.node(ref=ref1)[1], 'index': 2, 'link': None, 'gloss': glosses.get(sense1_id)})
 
-            out[-1]['link'] = bigram['link']
-            out.append({'word': self.node(ref=ref2)[1], 'index': 1, 'link': None, 'gloss': self._get_gloss(sense2_id)})
+            out[-1]['link'] = link
+            out.append({'word': self.node(ref=ref2)[1], 'index': 1, 'link': None, 'gloss': glosses.get(sense2_id)})
 
             ref1 = ref2
             prev_sense1_id = sense2_id
@@ -689,32 +1543,125 @@ class Game_API(object):
         return out
 
     def shortest_paths(self, key):
-        if self.paths_ is None:
-            self.paths_ = {}
-
-        if key not in self.paths_:
+        path = self._paths().get(key)
+        if path is None:
+            # search undirected graphs in the cache's key order, so that which of the equally short
+            # paths is returned never depends on the direction a pair was first asked in
+            source, target = key[::-1] if self._paths().is_reversed(key) else key
             try:
-                self.paths_[key] = nx.shortest_path(self._graph(), source=key[0], target=key[1])
-            except (nx.NetworkXError, nx.NetworkXNoPath):
+                if self.engine == 'csr':
+                    path = self._graph().shortest_path(source, target)
+                else:
+                    path = nx.shortest_path(self._graph(), source=source, target=target)
+            except (nx.NetworkXError, nx.NetworkXNoPath, KeyError):
                 raise PathUnknownError(key[0], key[1])
-        return self.paths_[key]
+            if path is None:
+                raise PathUnknownError(key[0], key[1])
+            if source != key[0]:
+                path = path[::-1]
+            self._paths().put(key, path)
+        return path
+
+    def cache_stats(self):
+        """
+        Returns: {'paths': {'entries', 'size', 'hits', 'misses', 'evictions'}, 'layers': {...}, 'glosses': {...}}
+        """
+        return {'paths': self._paths().stats(), 'layers': self._layers().stats(), 'glosses': self._gloss_cache().stats()}
 
     def node(self, ref=None, word=None):
-        return (ref, self._db().get_word(ref)) if not ref is None else (self._db().get_word_id(word), word)
+        return (ref, self._lexicon().word(ref)) if not ref is None else (self._lexicon().word_id(word), word)
+
+    def nodes(self, refs):
+        return [self.node(ref=ref) for ref in refs]
 
     def distance(self, ref1, ref2):
+        if self.num_landmarks:
+            try:
+                distance = self._landmarks().distance(ref1, ref2)
+            except KeyError:
+                distance = None
+            if distance is None:
+                raise PathUnknownError(ref1, ref2)
+            return distance
         return len(self.shortest_paths((ref1, ref2))) - 1
 
+    def distances(self, ref, refs):
+        """
+        Returns: List of the distances from ref to each of refs, None where there is no path,
+        from one breadth first search that stops once every ref is reached
+        """
+        if len(refs) == 1:
+            # the cached, bidirectional search of distance() is far cheaper than a one-to-many search
+            try:
+                return [self.distance(ref, refs[0])]
+            except PathUnknownError:
+                return [None]
+        if self.engine == 'csr':
+            return self._graph().distances(ref, refs)
+
+        graph = self._graph()
+        seen = {ref: 0} if ref in graph else {}
+        remaining = set([target for target in refs if target in graph and not target in seen])
+        frontier = seen.keys()
+        distance = 0
+        while frontier and remaining:
+            distance += 1
+            next_frontier = []
+            for node in frontier:
+                for nbr in graph[node]:
+                    if not nbr in seen:
+                        seen[nbr] = distance
+                        next_frontier.append(nbr)
+                        remaining.discard(nbr)
+            frontier = next_frontier
+        return [seen.get(target) for target in refs]
+
+    def bfs_layers(self, ref):
+        """
+        Returns: Graph.Layers grouping the nodes reachable from ref by distance, cached per ref
+        """
+        layers = self._layers().get(ref)
+        if layers is None:
+            try:
+                if self.engine == 'csr':
+                    layers = self._graph().bfs_layers(ref)
+                else:
+                    lengths = nx.single_source_shortest_path_length(self._graph(), ref)
+                    layers = Graph.Layers.from_distances(np.array(lengths.keys()), np.array(lengths.values()))
+            except (nx.NetworkXError, KeyError):
+                raise PathUnknownError(ref, ref)
+            self._layers().put(ref, layers)
+        return layers
+
     def random_node_by_distance(self, ref, min_distance, max_distance):
-        while True:
-            tail = self.random_node()
-            path = self.shortest_paths((ref, tail[0]))
-            if len(path) > min_distance:
-                if not max_distance is None:
-                    tail = self.node(ref=path[min(max_distance, len(path) - 1)])
-                break
-        return tail
-
-    def random_node(self):
         self._seed()
-        return self.node(ref=self._graph().nodes()[random.randrange(self._graph().order())])
+        tail = self.bfs_layers(ref).sample(random, min_distance, max_distance)
+        if tail is None:
+            raise PathUnknownError(ref, ref)
+        return self.node(ref=tail)
+
+    def random_pair_by_distance(self, min_distance, max_distance):
+        """
+        Returns: (head, tail) nodes with min_distance <= distance <= max_distance, drawn from the pair
+        index when enabled and it holds such a pair, otherwise a random head and a tail around it
+        """
+        self._seed()
+        pair = self._pair_index().sample(random, min_distance, max_distance) if self.pair_index else None
+        if pair is None:
+            head = self.random_node()
+            return head, self.random_node_by_distance(head[0], min_distance, max_distance)
+        # the index is built from the undirected csr graph, so either end can be the head
+        if random.random() < 0.5:
+            pair = pair[::-1]
+        return self.node(ref=pair[0]), self.node(ref=pair[1])
+
+    def random_node(self, seed=None):
+        node_ids = self._node_ids()
+        return self.node(ref=int(node_ids[self._random(seed).randrange(len(node_ids))]))
+
+    def random_nodes(self, n, seed=None):
+        """
+        Returns: List of n distinct random nodes, raises ValueError if the graph has fewer
+        """
+        node_ids = self._node_ids()
+        return self.nodes([int(node_ids[index]) for index in self._random(seed).sample(xrange(len(node_ids)), n)])
@@ -0,0 +1,1039 @@
+"""Compact Graph Engine
+
+This module implements an undirected word graph stored as NumPy CSR
+arrays, used by Game_API as a low memory alternative to networkx, an
+in-memory lexicon of its words, and a memory-mapped binary snapshot
+format to persist them.
+
+"""
+import array
+import json
+import mmap
+import multiprocessing
+import numpy as np
+import os
+import struct
+import threading
+import zlib
+
+class SnapshotError(Exception):
+    pass
+
+shared_graph_ = None
+
+def sample_source_pairs(args):
+    """
+    Pool worker for Pair_Index.sample_sources: searches the graph inherited from the parent at fork,
+    so it is never pickled.
+    """
+    source, pairs_per_distance, seed = args
+    return Pair_Index.sample_source(shared_graph_, source, pairs_per_distance, seed)
+
+def find_sorted(values, value):
+    """
+    Returns: Position of value in the sorted array values, -1 if it is not there. value is cast to
+    the array's dtype first, since searchsorted would otherwise convert the whole array each call.
+    """
+    try:
+        key = values.dtype.type(value)
+    except OverflowError:
+        return -1
+    if key != value:
+        return -1
+    position = int(values.searchsorted(key))
+    if position < len(values) and values[position] == key:
+        return position
+    return -1
+
+class Snapshot(object):
+    """
+    Versioned binary container of named NumPy arrays, read back through mmap so that the
+    arrays are used in place and their pages are shared by every process mapping the file.
+
+    Layout: magic, version and header length (PREFIX), a JSON header holding the caller's
+    metadata, the crc32 checksum of the data and the dtype, shape and offset of each array,
+    then the array data with each array aligned to ALIGN bytes.
+    """
+
+    MAGIC = 'BACONSNP'
+    VERSION = 1
+    PREFIX = struct.Struct('<8sII')
+    ALIGN = 8
+
+    @classmethod
+    def align(cls, offset):
+        return (offset + cls.ALIGN - 1) // cls.ALIGN * cls.ALIGN
+
+    @staticmethod
+    def dtype_str(dtype):
+        """
+        Returns: JSON serializable form of dtype, the field list of a structured dtype
+        """
+        return dtype.descr if dtype.names else dtype.str
+
+    @staticmethod
+    def str_dtype(att):
+        if isinstance(att, list):
+            return np.dtype([(str(name), str(fmt)) for name, fmt in att])
+        return np.dtype(str(att))
+
+    @classmethod
+    def write(cls, path, arrays, meta=None):
+        """
+        Write the dict of named arrays and the metadata dict to path, atomically replacing it.
+        Returns: crc32 checksum of the arrays' data, as stored in the header
+        """
+        table = {}
+        offset = 0
+        for name in sorted(arrays):
+            array = np.ascontiguousarray(arrays[name])
+            arrays[name] = array
+            table[name] = {'dtype': cls.dtype_str(array.dtype), 'shape': list(array.shape), 'offset': offset}
+            offset = cls.align(offset + array.nbytes)
+
+        checksum = 0
+        for name in sorted(arrays):
+            checksum = zlib.crc32(arrays[name].tobytes(), checksum)
+
+        header = json.dumps({'meta': meta or {}, 'checksum': checksum & 0xffffffff, 'arrays': table})
+        start = cls.align(cls.PREFIX.size + len(header))
+
+        tmp_path = "%s.tmp" % (path)
+        with open(tmp_path, 'wb') as fp:
+            fp.write(cls.PREFIX.pack(cls.MAGIC, cls.VERSION, len(header)))
+            fp.write(header)
+            for name in sorted(arrays):
+                fp.seek(start + table[name]['offset'])
+                fp.write(arrays[name].tobytes())
+            fp.truncate(start + offset)
+        os.rename(tmp_path, path)
+        return checksum & 0xffffffff
+
+    @classmethod
+    def read(cls, path, verify=False):
+        """
+        Check the prefix, the header and that every array lies within the file, and with verify
+        also the checksum of the data, which reads the whole file.
+        Returns: (arrays, meta) where arrays is a dict of read-only arrays backed by the mapped file
+        """
+        with open(path, 'rb') as fp:
+            if os.fstat(fp.fileno()).st_size < cls.PREFIX.size:
+                raise SnapshotError("%s is truncated" % (path))
+            buf = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, header_len = cls.PREFIX.unpack_from(buf, 0)
+        if magic != cls.MAGIC:
+            raise SnapshotError("%s is not a snapshot file" % (path))
+        if version != cls.VERSION:
+            raise SnapshotError("%s has snapshot version %d, expected %d" % (path, version, cls.VERSION))
+        if cls.PREFIX.size + header_len > len(buf):
+            raise SnapshotError("%s is truncated" % (path))
+
+        try:
+            header = json.loads(buf[cls.PREFIX.size:cls.PREFIX.size + header_len])
+            start = cls.align(cls.PREFIX.size + header_len)
+            meta = header['meta']
+            meta['checksum'] = header['checksum']
+
+            arrays = {}
+            checksum = 0
+            for name in sorted(header['arrays']):
+                att = header['arrays'][name]
+                dtype = cls.str_dtype(att['dtype'])
+                count = int(np.prod(att['shape']))
+                if start + att['offset'] + count * dtype.itemsize > len(buf):
+                    raise SnapshotError("%s is truncated" % (path))
+                arrays[str(name)] = np.frombuffer(buf, dtype=dtype, count=count, offset=start + att['offset']).reshape(att['shape'])
+                if verify:
+                    checksum = zlib.crc32(arrays[name].tobytes(), checksum)
+        except (ValueError, KeyError, TypeError) as exc:
+            raise SnapshotError("%s has an invalid header: %s" % (path, exc))
+
+        if verify and (checksum & 0xffffffff) != meta['checksum']:
+            raise SnapshotError("%s failed its checksum" % (path))
+        return arrays, meta
+
+class CSR_Graph(object):
+    """
+    Undirected graph over dense node indexes.
+
+    node_ids:   sorted word_ids, the dense index of a node is its position
+    indptr:     neighbors of node i are indices[indptr[i]:indptr[i + 1]]
+    indices:    dense neighbor index of each adjacency slot
+    edges:      undirected edge index of each adjacency slot
+    bigram_ptr: bigram ids of edge e are bigram_ids[bigram_ptr[e]:bigram_ptr[e + 1]]
+    bigram_ids: bigram ids grouped by edge, in bigram_id order within an edge
+
+    Optional payload of the first bigram of each edge:
+
+    edge_data:  EDGE_DTYPE record per edge, sense1_id being the sense of the edge's lower word_id
+    link_names: link name of each link_id
+    """
+
+    ARRAYS = ['node_ids', 'indptr', 'indices', 'edges', 'bigram_ptr', 'bigram_ids']
+    PAYLOAD_ARRAYS = ['edge_data', 'link_names']
+    EDGE_DTYPE = np.dtype([('sense1_id', '<u4'), ('sense2_id', '<u4'), ('link_id', '<u4'), ('relation_id', '<u4')])
+
+    def __init__(self, node_ids, indptr, indices, edges, bigram_ptr, bigram_ids, meta=None, lexicon=None, edge_data=None, link_names=None):
+        self.node_ids = node_ids
+        self.indptr = indptr
+        self.indices = indices
+        self.edges = edges
+        self.bigram_ptr = bigram_ptr
+        self.bigram_ids = bigram_ids
+        self.meta = {} if meta is None else meta
+        self.lexicon = lexicon
+        self.edge_data = edge_data
+        self.link_names = link_names
+        self.path_finder_ = None
+
+    def save(self, path, meta=None):
+        """
+        Write the graph to a snapshot file, together with its edge payload and lexicon when it has
+        them. meta is added to the graph's own metadata, such as its component count.
+        """
+        self.meta = dict(self.meta, **(meta or {}))
+        arrays = dict([(name, getattr(self, name)) for name in self.ARRAYS])
+        if self.has_payload():
+            arrays.update([(name, getattr(self, name)) for name in self.PAYLOAD_ARRAYS])
+        if not self.lexicon is None:
+            arrays.update(self.lexicon.arrays())
+        self.meta['checksum'] = Snapshot.write(path, arrays, self.meta)
+        return self
+
+    @classmethod
+    def load(cls, path, verify=False):
+        arrays, meta = Snapshot.read(path, verify=verify)
+        missing = [name for name in cls.ARRAYS if not name in arrays]
+        if missing:
+            raise SnapshotError("%s is missing arrays %s" % (path, ', '.join(missing)))
+        return cls(*[arrays[name] for name in cls.ARRAYS], meta=meta, lexicon=Lexicon.from_arrays(arrays),
+                   edge_data=arrays.get('edge_data'), link_names=arrays.get('link_names'))
+
+    @classmethod
+    def from_edges(cls, word1_ids, word2_ids, bigram_ids, largest_component=True, bigram_data=None, link_names=None):
+        """
+        Build a graph from parallel arrays of bigram endpoints. Bigrams joining the same pair
+        of words become one edge. With largest_component only its largest connected component
+        is kept. bigram_data, an EDGE_DTYPE record per bigram with sense1_id the sense of
+        word1, becomes the edge_data of the edges' first bigrams.
+        """
+        word1_ids = np.asarray(word1_ids, dtype=np.uint32)
+        word2_ids = np.asarray(word2_ids, dtype=np.uint32)
+        bigram_ids = np.asarray(bigram_ids, dtype=np.uint32)
+
+        node_ids, dense = np.unique(np.concatenate((word1_ids, word2_ids)), return_inverse=True)
+        order = len(node_ids)
+        node1 = dense[:len(word1_ids)].astype(np.int64)
+        node2 = dense[len(word1_ids):].astype(np.int64)
+
+        lo = np.minimum(node1, node2)
+        hi = np.maximum(node1, node2)
+        keys, edge_of_bigram = np.unique(lo * order + hi, return_inverse=True)
+        size = len(keys)
+        lo = keys // order
+        hi = keys % order
+
+        by_edge = np.argsort(edge_of_bigram, kind='mergesort')
+        bigram_ptr = np.zeros(size + 1, dtype=np.int64)
+        bigram_ptr[1:] = np.cumsum(np.bincount(edge_of_bigram, minlength=size))
+
+        loops = lo == hi
+        src = np.concatenate((lo, hi[~loops]))
+        dst = np.concatenate((hi, lo[~loops]))
+        slot_edges = np.concatenate((np.arange(size), np.arange(size)[~loops]))
+        slots = np.lexsort((dst, src))
+
+        indptr = np.zeros(order + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(np.bincount(src, minlength=order))
+
+        edge_data = None
+        if not bigram_data is None:
+            first = by_edge[bigram_ptr[:-1]]
+            edge_data = np.array(bigram_data, dtype=cls.EDGE_DTYPE)[first]
+            flip = node1[first] > node2[first]
+            edge_data['sense1_id'][flip], edge_data['sense2_id'][flip] = edge_data['sense2_id'][flip], edge_data['sense1_id'][flip]
+
+        graph = cls(node_ids,
+                    indptr,
+                    dst[slots].astype(np.int32),
+                    slot_edges[slots].astype(np.int32),
+                    bigram_ptr,
+                    bigram_ids[by_edge],
+                    edge_data=edge_data,
+                    link_names=link_names)
+
+        if largest_component:
+            labels = graph.component_labels()
+            if len(labels) and labels.max() > 0:
+                keep = labels == np.argmax(np.bincount(labels))
+                kept = keep[node1] & keep[node2]
+                graph = cls.from_edges(word1_ids[kept], word2_ids[kept], bigram_ids[kept], largest_component=False,
+                                       bigram_data=None if bigram_data is None else np.asarray(bigram_data)[kept], link_names=link_names)
+            graph.meta['components'] = min(1, graph.order())
+        return graph
+
+    def order(self):
+        return len(self.node_ids)
+
+    def size(self):
+        return len(self.bigram_ptr) - 1
+
+    def nodes(self):
+        return self.node_ids
+
+    def has_node(self, ref):
+        return find_sorted(self.node_ids, ref) >= 0
+
+    def has_nodes(self, refs):
+        """
+        Returns: Boolean array marking which of refs are nodes of the graph
+        """
+        return self.indexes(refs) >= 0
+
+    def index(self, ref):
+        """
+        Returns: Dense index of the node with word_id ref, raises KeyError if unknown
+        """
+        index = find_sorted(self.node_ids, ref)
+        if index < 0:
+            raise KeyError(ref)
+        return index
+
+    def ref(self, index):
+        return int(self.node_ids[index])
+
+    def refs(self, indexes):
+        return self.node_ids[indexes].tolist()
+
+    def indexes(self, refs):
+        """
+        Returns: Array of the dense index of each of refs, -1 where it is not a node. As in
+        find_sorted, refs the dtype of node_ids cannot hold are unknown rather than cast onto
+        other word_ids.
+        """
+        refs = np.asarray(refs)
+        indexes = np.full(len(refs), -1, dtype=np.int64)
+        if not len(refs) or not self.order():
+            return indexes
+        limits = np.iinfo(self.node_ids.dtype)
+        valid = ((refs >= limits.min) & (refs <= limits.max)).astype(bool)
+        keys = np.zeros(len(refs), dtype=self.node_ids.dtype)
+        keys[valid] = refs[valid].astype(self.node_ids.dtype)
+        valid &= (keys == refs).astype(bool)
+        positions = np.minimum(np.searchsorted(self.node_ids, keys), self.order() - 1)
+        found = valid & (self.node_ids[positions] == keys)
+        indexes[found] = positions[found]
+        return indexes
+
+    def neighbors(self, index):
+        return self.indices[self.indptr[index]:self.indptr[index + 1]]
+
+    def expand(self, frontier):
+        """
+        Returns: (neighbors, sources) arrays listing every adjacency slot of the frontier nodes
+        """
+        starts = self.indptr[frontier]
+        counts = self.indptr[frontier + 1] - starts
+        total = counts.sum()
+        if total == 0:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=frontier.dtype)
+        offsets = np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(total)
+        return self.indices[offsets], np.repeat(frontier, counts)
+
+    def edge(self, ref1, ref2):
+        """
+        Returns: Undirected edge index joining ref1 and ref2, raises KeyError if there is none
+        """
+        index1 = self.index(ref1)
+        index2 = self.index(ref2)
+        position = find_sorted(self.neighbors(index1), index2)
+        if position < 0:
+            raise KeyError((ref1, ref2))
+        return int(self.edges[self.indptr[index1] + position])
+
+    def bigrams(self, ref1, ref2):
+        edge = self.edge(ref1, ref2)
+        return self.bigram_ids[self.bigram_ptr[edge]:self.bigram_ptr[edge + 1]].tolist()
+
+    def has_payload(self):
+        return not self.edge_data is None and not self.link_names is None
+
+    def fingerprint(self):
+        """
+        Returns: crc32 of the graph's arrays, its edge payload included, so equal graphs have equal fingerprints
+        """
+        checksum = 0
+        for name in self.ARRAYS + (self.PAYLOAD_ARRAYS if self.has_payload() else []):
+            checksum = zlib.crc32(getattr(self, name).tobytes(), checksum)
+        return checksum & 0xffffffff
+
+    def link_senses(self, ref1, ref2):
+        """
+        Returns: (link, sense1_id, sense2_id) of the first bigram joining ref1 and ref2, with
+        sense1_id the sense of ref1, raises KeyError if there is no such edge
+        """
+        data = self.edge_data[self.edge(ref1, ref2)]
+        sense1_id, sense2_id = int(data['sense1_id']), int(data['sense2_id'])
+        if ref1 > ref2:
+            sense1_id, sense2_id = sense2_id, sense1_id
+        return str(self.link_names[data['link_id']]), sense1_id, sense2_id
+
+    def bfs_distances(self, index, targets=None):
+        """
+        Returns: Array holding the distance of every dense node from index, -1 if unreachable.
+        With an array of target indexes the search stops once they are all reached.
+        """
+        distances = np.full(self.order(), -1, dtype=np.int32)
+        distances[index] = 0
+        frontier = np.array([index])
+        distance = 0
+        while len(frontier) and (targets is None or (distances[targets] < 0).any()):
+            distance += 1
+            nbrs, srcs = self.expand(frontier)
+            frontier = np.unique(nbrs[distances[nbrs] < 0])
+            distances[frontier] = distance
+        return distances
+
+    def distances(self, ref, refs):
+        """
+        Returns: List of the distances from ref to each of refs, None where there is no path,
+        from one search that stops once every ref is reached
+        """
+        indexes = self.indexes(refs)
+        known = indexes >= 0
+        if not self.has_node(ref) or not known.any():
+            return [None] * len(refs)
+        targets = indexes[known]
+        distances = np.full(len(refs), -1, dtype=np.int32)
+        distances[known] = self.bfs_distances(self.index(ref), targets)[targets]
+        return [None if distance < 0 else int(distance) for distance in distances]
+
+    def bfs_layers(self, ref):
+        """
+        Returns: Layers of the nodes reachable from ref, raises KeyError if ref is unknown
+        """
+        return Layers.from_distances(self.node_ids, self.bfs_distances(self.index(ref)))
+
+    def component_labels(self):
+        """
+        Returns: Array holding the connected component number of each dense node
+        """
+        labels = np.full(self.order(), -1, dtype=np.int32)
+        label = 0
+        for root in range(self.order()):
+            if labels[root] < 0:
+                labels[root] = label
+                frontier = np.array([root])
+                while len(frontier):
+                    nbrs, srcs = self.expand(frontier)
+                    frontier = np.unique(nbrs[labels[nbrs] < 0])
+                    labels[frontier] = label
+                label += 1
+        return labels
+
+    def num_components(self):
+        """
+        Returns: Number of connected components, counted once and kept in meta so that snapshots carry it
+        """
+        if not 'components' in self.meta:
+            self.meta['components'] = int(self.component_labels().max()) + 1 if self.order() else 0
+        return self.meta['components']
+
+    def connected_components(self):
+        labels = self.component_labels()
+        order = np.argsort(labels, kind='mergesort')
+        bounds = np.cumsum(np.bincount(labels))[:-1]
+        return [self.refs(comp) for comp in np.split(order, bounds)]
+
+    def path_finder(self):
+        if self.path_finder_ is None:
+            self.path_finder_ = Path_Finder(self)
+        return self.path_finder_
+
+    def shortest_path(self, ref1, ref2):
+        """
+        Returns: List of refs along a shortest path from ref1 to ref2 or None if there is no path,
+        raises KeyError if either ref is unknown
+        """
+        path = self.path_finder().shortest_path(self.index(ref1), self.index(ref2))
+        return None if path is None else self.refs(path)
+
+class Lexicon(object):
+    """
+    Two way word_id <-> word table held in a few flat arrays.
+
+    word_ids: sorted word ids, word i is blob[offsets[i]:offsets[i + 1]]
+    offsets:  start of each word in blob, plus the end of the last one
+    blob:     the words' bytes, concatenated
+    slots:    open addressing hash table (linear probing) of word positions, -1 if empty,
+              hashed on the lower cased word so lookups can fall back to a case
+              insensitive match like MySQL's default collation
+    """
+
+    ARRAYS = ['word_ids', 'offsets', 'blob', 'slots']
+    PREFIX = 'lexicon_'
+    EMPTY = -1
+
+    def __init__(self, word_ids, offsets, blob, slots):
+        self.word_ids = word_ids
+        self.offsets = offsets
+        self.blob = blob
+        self.slots = slots
+        self.mask = len(slots) - 1
+
+    @classmethod
+    def from_words(cls, words):
+        """
+        Returns: Lexicon of an iterable of (word_id, word) pairs
+        """
+        words = sorted(words)
+        strs = [word if isinstance(word, str) else word.encode('utf-8') for word_id, word in words]
+        offsets = np.zeros(len(strs) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(word) for word in strs])
+
+        size = 8
+        while size < 2 * len(strs):
+            size *= 2
+        slots = [cls.EMPTY] * size
+        for position, word in enumerate(strs):
+            slot = cls.hash(word) & (size - 1)
+            while slots[slot] != cls.EMPTY:
+                slot = (slot + 1) & (size - 1)
+            slots[slot] = position
+
+        return cls(np.array([word_id for word_id, word in words], dtype=np.uint32),
+                   offsets,
+                   np.frombuffer(''.join(strs), dtype=np.uint8),
+                   np.array(slots, dtype=np.int32))
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """
+        Returns: Lexicon of the PREFIX'ed snapshot arrays, None if they are missing
+        """
+        if not all([cls.PREFIX + name in arrays for name in cls.ARRAYS]):
+            return None
+        return cls(*[arrays[cls.PREFIX + name] for name in cls.ARRAYS])
+
+    def arrays(self):
+        return dict([(self.PREFIX + name, getattr(self, name)) for name in self.ARRAYS])
+
+    def fingerprint(self):
+        """
+        Returns: crc32 of the lexicon's arrays
+        """
+        checksum = 0
+        for name in self.ARRAYS:
+            checksum = zlib.crc32(getattr(self, name).tobytes(), checksum)
+        return checksum & 0xffffffff
+
+    @staticmethod
+    def hash(word):
+        return zlib.crc32(word.lower()) & 0xffffffff
+
+    def at(self, position):
+        return self.blob[self.offsets[position]:self.offsets[position + 1]].tostring()
+
+    def word(self, word_id):
+        """
+        Returns: Word with word_id, None if unknown
+        """
+        position = find_sorted(self.word_ids, word_id)
+        return None if position < 0 else self.at(position)
+
+    def word_id(self, word):
+        """
+        Returns: word_id of word, else of a case insensitive match, None if unknown
+        """
+        if not isinstance(word, str):
+            word = word.encode('utf-8')
+        folded = None
+        slot = self.hash(word) & self.mask
+        while self.slots[slot] != self.EMPTY:
+            position = self.slots[slot]
+            candidate = self.at(position)
+            if candidate == word:
+                return int(self.word_ids[position])
+            if folded is None and candidate.lower() == word.lower():
+                folded = int(self.word_ids[position])
+            slot = (slot + 1) & self.mask
+        return folded
+
+    def __len__(self):
+        return len(self.word_ids)
+
+class Gloss_Store(object):
+    """
+    sense_id -> gloss table with every distinct gloss stored once.
+
+    sense_ids: sorted sense ids
+    glosses:   index of each sense's gloss, -1 if it has none
+    offsets:   gloss g is blob[offsets[g]:offsets[g + 1]]
+    blob:      the distinct glosses' bytes, concatenated
+    """
+
+    ARRAYS = ['sense_ids', 'glosses', 'offsets', 'blob']
+    NONE = -1
+
+    def __init__(self, sense_ids, glosses, offsets, blob, meta=None):
+        self.sense_ids = sense_ids
+        self.glosses = glosses
+        self.offsets = offsets
+        self.blob = blob
+        self.meta = {} if meta is None else meta
+
+    @classmethod
+    def from_glosses(cls, glosses):
+        """
+        Returns: Gloss_Store of an iterable of (sense_id, gloss) pairs
+        """
+        sense_ids = array.array('I')
+        indexes = array.array('i')
+        distinct = {}
+        strs = []
+        for sense_id, gloss in glosses:
+            if gloss is None:
+                index = cls.NONE
+            else:
+                if not isinstance(gloss, str):
+                    gloss = gloss.encode('utf-8')
+                index = distinct.setdefault(gloss, len(strs))
+                if index == len(strs):
+                    strs.append(gloss)
+            sense_ids.append(sense_id)
+            indexes.append(index)
+
+        sense_ids = np.frombuffer(sense_ids, dtype=np.uint32)
+        order = np.argsort(sense_ids, kind='mergesort')
+        offsets = np.zeros(len(strs) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(gloss) for gloss in strs])
+        return cls(sense_ids[order], np.frombuffer(indexes, dtype=np.int32)[order], offsets, np.frombuffer(''.join(strs), dtype=np.uint8))
+
+    def save(self, path, meta=None):
+        self.meta = {} if meta is None else meta
+        Snapshot.write(path, dict([(name, getattr(self, name)) for name in self.ARRAYS]), self.meta)
+        return self
+
+    @classmethod
+    def load(cls, path, verify=False):
+        arrays, meta = Snapshot.read(path, verify=verify)
+        missing = [name for name in cls.ARRAYS if not name in arrays]
+        if missing:
+            raise SnapshotError("%s is missing arrays %s" % (path, ', '.join(missing)))
+        return cls(*[arrays[name] for name in cls.ARRAYS], meta=meta)
+
+    def gloss(self, sense_id):
+        """
+        Returns: Gloss of sense_id, None if it is unknown or has none
+        """
+        position = find_sorted(self.sense_ids, sense_id)
+        if position < 0:
+            return None
+        index = self.glosses[position]
+        if index == self.NONE:
+            return None
+        return self.blob[self.offsets[index]:self.offsets[index + 1]].tostring()
+
+    def get_glosses(self, sense_ids):
+        return dict([(sense_id, self.gloss(sense_id)) for sense_id in set(sense_ids)])
+
+    def __len__(self):
+        return len(self.sense_ids)
+
+class Layers(object):
+    """
+    Nodes reachable from a source grouped by breadth first search distance: refs is sorted by
+    distance and the nodes at distance d are refs[offsets[d]:offsets[d + 1]].
+    """
+
+    def __init__(self, refs, offsets):
+        self.refs = refs
+        self.offsets = offsets
+
+    @classmethod
+    def from_distances(cls, refs, distances):
+        """
+        Returns: Layers built from parallel arrays of refs and their distances, -1 if unreachable
+        """
+        reached = distances >= 0
+        order = np.argsort(distances[reached], kind='mergesort')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(distances[reached]))])
+        return cls(refs[reached][order], offsets)
+
+    def depth(self):
+        return len(self.offsets) - 2
+
+    def span(self, min_distance, max_distance=None):
+        """
+        Returns: (start, stop) slice of refs holding the nodes with min_distance <= distance <= max_distance
+        """
+        min_distance = max(0, min_distance)
+        max_distance = self.depth() if max_distance is None else min(max_distance, self.depth())
+        if min_distance > max_distance:
+            return 0, 0
+        return int(self.offsets[min_distance]), int(self.offsets[max_distance + 1])
+
+    def count(self, min_distance, max_distance=None):
+        start, stop = self.span(min_distance, max_distance)
+        return stop - start
+
+    def sample(self, rnd, min_distance, max_distance=None):
+        """
+        Returns: Ref drawn uniformly from the nodes with min_distance <= distance <= max_distance,
+        None if there are none
+        """
+        start, stop = self.span(min_distance, max_distance)
+        if start == stop:
+            return None
+        return int(self.refs[rnd.randrange(start, stop)])
+
+    def nbytes(self):
+        return self.refs.nbytes + self.offsets.nbytes
+
+class Path_Finder(object):
+    """
+    Unweighted shortest paths on a CSR_Graph by bidirectional breadth first search, expanding
+    whole levels of whichever frontier is smaller. On a small-world graph a search ends after a
+    few levels and touches few nodes, so numpy's per call overhead would dominate: the search is
+    a plain Python loop reading the graph's own indptr and indices arrays, which stay shared
+    when they are mapped from a snapshot. Only the neighbors of a hub, a node of more than
+    HUB_DEGREE neighbors, are checked with numpy in one go.
+
+    Visited nodes are marked in reusable per thread buffers: marks holds the stamp of the search
+    and side that last reached each node, and parents the node it was reached from, so a search
+    allocates nothing in proportion to the graph and needs no clearing. One Path_Finder is shared
+    by every thread, each thread paying 12 bytes per node for its buffers on its first search.
+    """
+
+    HUB_DEGREE = 128
+
+    def __init__(self, graph):
+        self.indptr = graph.indptr
+        self.indices = graph.indices
+        self.order = graph.order()
+        self.buffers_ = threading.local()
+
+    def buffers(self):
+        """
+        Returns: (marks, parents, hub_marks, hub_parents, stamp) where marks and parents are this
+        thread's arrays, hub_marks and hub_parents numpy views of them, and stamp is new to this
+        search, whose two sides mark the nodes they reach with stamp and stamp + 1
+        """
+        buffers = self.buffers_
+        if not hasattr(buffers, 'arrays'):
+            marks = array.array('l', [0]) * self.order
+            parents = array.array('i', [0]) * self.order
+            buffers.arrays = (marks, parents, np.frombuffer(marks, dtype='i%d' % (marks.itemsize)),
+                              np.frombuffer(parents, dtype='i%d' % (parents.itemsize)))
+            buffers.stamp = 0
+        buffers.stamp += 2
+        return buffers.arrays + (buffers.stamp,)
+
+    def search(self, source, target, cutoff=None):
+        """
+        Returns: (distance, link, parents) where link is the pair of adjacent nodes, reached from
+        source and from target, at which the searches met, or (source, source) when target is
+        source. parents holds the node each visited node was reached from, -1 for source and
+        target, and is only valid until this thread's next search. cutoff must be a known upper
+        bound on the distance: once the frontiers have not met within cutoff - 1 levels the
+        distance must be cutoff and link is None. distance and link are both None when there
+        is no path.
+        """
+        item, indices, hub_degree = self.indptr.item, self.indices, self.HUB_DEGREE
+        marks, parents, hub_marks, hub_parents, stamp = self.buffers()
+        if source == target:
+            return 0, (source, source), parents
+
+        marks[source], marks[target] = stamp, stamp + 1
+        parents[source] = parents[target] = -1
+        frontiers = [[source], [target]]
+        distance = 0
+        while frontiers[0] and frontiers[1]:
+            if not cutoff is None and distance >= cutoff - 1:
+                return cutoff, None, parents
+
+            side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+            own, other = stamp + side, stamp + 1 - side
+            frontier = []
+            append = frontier.append
+            distance += 1
+            for node in frontiers[side]:
+                start, end = item(node), item(node + 1)
+                if end - start > hub_degree:
+                    nbrs = indices[start:end]
+                    found = hub_marks[nbrs]
+                    met = np.flatnonzero(found == other)
+                    if len(met):
+                        nbr = int(nbrs[met[0]])
+                        return distance, ((node, nbr) if side == 0 else (nbr, node)), parents
+                    new = nbrs[found < stamp]
+                    hub_marks[new] = own
+                    hub_parents[new] = node
+                    frontier.extend(new.tolist())
+                    continue
+                for nbr in indices[start:end].tolist():
+                    if marks[nbr] < stamp:
+                        marks[nbr] = own
+                        parents[nbr] = node
+                        append(nbr)
+                    elif marks[nbr] == other:
+                        return distance, ((node, nbr) if side == 0 else (nbr, node)), parents
+            frontiers[side] = frontier
+        return None, None, parents
+
+    def shortest_path(self, source, target):
+        """
+        Returns: List of dense indexes along a shortest path from source to target or None
+        """
+        distance, link, parents = self.search(source, target)
+        return None if link is None else self.join(link, parents)
+
+    def distance(self, source, target, cutoff=None):
+        """
+        Returns: Distance from source to target or None if there is no path
+        """
+        return self.search(source, target, cutoff=cutoff)[0]
+
+    @staticmethod
+    def join(link, parents):
+        if link[0] == link[1]:
+            return [link[0]]
+        paths = []
+        for node in link:
+            path = [node]
+            while parents[path[-1]] >= 0:
+                path.append(parents[path[-1]])
+            paths.append(path)
+        return paths[0][::-1] + paths[1]
+
+class Landmarks(object):
+    """
+    ALT style distance oracle: breadth first search distances from a few landmark nodes to
+    every node, stored as a (nodes, landmarks) uint8 array with UNREACHED marking distances
+    that are unknown. For every landmark l the triangle inequality bounds the distance between
+    s and t by |d(l, s) - d(l, t)| <= d(s, t) <= d(l, s) + d(l, t).
+
+    The bounds of a pair take a few dozen scalar comparisons, fewer than numpy's per call
+    overhead, so they are taken in plain Python from the two nodes' rows, which lie side by side
+    in the array as it is mapped from the landmarks file.
+    """
+
+    UNREACHED = 255
+    ARRAYS = ['landmark_ids', 'node_distances']
+
+    def __init__(self, graph, landmark_ids, node_distances, meta=None):
+        self.graph = graph
+        self.landmark_ids = landmark_ids
+        self.node_distances = node_distances
+        self.meta = {} if meta is None else meta
+
+    @classmethod
+    def build(cls, graph, num_landmarks=16):
+        """
+        Choose landmarks alternating between the highest degree node not yet chosen, which
+        tightens upper bounds, and the node farthest from the chosen landmarks, which tightens
+        lower bounds.
+        """
+        degrees = np.diff(graph.indptr)
+        by_degree = np.argsort(-degrees, kind='mergesort')
+        nearest = np.full(graph.order(), np.iinfo(np.int32).max, dtype=np.int64)
+
+        landmarks = []
+        distances = []
+        while len(landmarks) < min(num_landmarks, graph.order()):
+            if len(landmarks) % 2 == 0:
+                index = [index for index in by_degree[:len(landmarks) + 1] if not index in landmarks][0]
+            else:
+                index = int(np.argmax(nearest))
+            bfs = graph.bfs_distances(index)
+            reached = (bfs >= 0) & (bfs < cls.UNREACHED)
+            nearest[reached] = np.minimum(nearest[reached], bfs[reached])
+            nearest[index] = -1
+            landmarks.append(index)
+            distances.append(np.where(reached, bfs, cls.UNREACHED).astype(np.uint8))
+
+        return cls(graph, graph.node_ids[landmarks], np.ascontiguousarray(np.vstack(distances).T))
+
+    def save(self, path, meta=None):
+        self.meta = {} if meta is None else meta
+        Snapshot.write(path, dict([(name, getattr(self, name)) for name in self.ARRAYS]), self.meta)
+        return self
+
+    @classmethod
+    def load(cls, graph, path, verify=False):
+        arrays, meta = Snapshot.read(path, verify=verify)
+        missing = [name for name in cls.ARRAYS if not name in arrays]
+        if missing:
+            raise SnapshotError("%s is missing arrays %s" % (path, ', '.join(missing)))
+        if arrays['node_distances'].shape != (graph.order(), len(arrays['landmark_ids'])):
+            raise SnapshotError("%s does not match the graph" % (path))
+        return cls(graph, arrays['landmark_ids'], arrays['node_distances'], meta=meta)
+
+    def bounds(self, ref1, ref2):
+        """
+        Returns: (lower, upper) bounds on the distance between ref1 and ref2, upper is None if
+        no landmark reaches both, raises KeyError if either ref is unknown
+        """
+        return self.index_bounds(self.graph.index(ref1), self.graph.index(ref2))
+
+    def index_bounds(self, index1, index2):
+        if index1 == index2:
+            return 0, 0
+        lower, upper = 1, None
+        for distance1, distance2 in zip(self.node_distances[index1].tolist(), self.node_distances[index2].tolist()):
+            if distance1 == self.UNREACHED or distance2 == self.UNREACHED:
+                continue
+            lower = max(lower, abs(distance1 - distance2))
+            if upper is None or distance1 + distance2 < upper:
+                upper = distance1 + distance2
+        return lower, upper
+
+    def distance(self, ref1, ref2):
+        """
+        Returns: Exact distance between ref1 and ref2 or None if there is no path. When the
+        bounds differ the search is cut off at the upper bound.
+        """
+        index1 = self.graph.index(ref1)
+        index2 = self.graph.index(ref2)
+        lower, upper = self.index_bounds(index1, index2)
+        if lower == upper:
+            return lower
+        return self.graph.path_finder().distance(index1, index2, cutoff=upper)
+
+class Pair_Index(object):
+    """
+    (head, tail) pairs at exact shortest path distances, sampled offline from breadth first
+    searches of source nodes which become the heads. Pairs are sorted by distance, the pairs at
+    distance d being heads/tails[offsets[d]:offsets[d + 1]], so a pair of a given difficulty is
+    drawn in constant time.
+
+    sources holds the heads searched on the graph the index was built from and stale the heads
+    searched on an earlier graph whose pairs were dropped and which await a new search.
+    """
+
+    ARRAYS = ['sources', 'stale', 'heads', 'tails', 'offsets']
+
+    def __init__(self, sources, stale, heads, tails, offsets, meta=None):
+        self.sources = sources
+        self.stale = stale
+        self.heads = heads
+        self.tails = tails
+        self.offsets = offsets
+        self.meta = {} if meta is None else meta
+
+    @classmethod
+    def from_pairs(cls, sources, stale, heads, tails, distances):
+        order = np.argsort(distances, kind='mergesort')
+        offsets = np.zeros(1, dtype=np.int64)
+        if len(distances):
+            offsets = np.concatenate([offsets, np.cumsum(np.bincount(distances))])
+        return cls(np.asarray(sources, dtype=np.uint32),
+                   np.asarray(stale, dtype=np.uint32),
+                   np.asarray(heads, dtype=np.uint32)[order],
+                   np.asarray(tails, dtype=np.uint32)[order],
+                   offsets)
+
+    def save(self, path, meta=None):
+        self.meta = {} if meta is None else meta
+        Snapshot.write(path, dict([(name, getattr(self, name)) for name in self.ARRAYS]), self.meta)
+        return self
+
+    @classmethod
+    def load(cls, path, verify=False):
+        arrays, meta = Snapshot.read(path, verify=verify)
+        missing = [name for name in cls.ARRAYS if not name in arrays]
+        if missing:
+            raise SnapshotError("%s is missing arrays %s" % (path, ', '.join(missing)))
+        return cls(*[arrays[name] for name in cls.ARRAYS], meta=meta)
+
+    @classmethod
+    def sample_source(cls, graph, source, pairs_per_distance, seed):
+        """
+        Returns: (heads, tails, distances) of up to pairs_per_distance tails drawn from every
+        distance layer around source
+        """
+        rnd = np.random.RandomState([seed, source])
+        layers = graph.bfs_layers(source)
+        tails = []
+        for distance in range(1, layers.depth() + 1):
+            start, stop = layers.span(distance, distance)
+            if stop - start > pairs_per_distance:
+                tails.append(layers.refs[start + rnd.choice(stop - start, pairs_per_distance, replace=False)])
+            else:
+                tails.append(layers.refs[start:stop])
+        counts = [len(layer) for layer in tails]
+        return (np.full(sum(counts), source, dtype=np.uint32),
+                np.concatenate(tails) if tails else np.empty(0, dtype=np.uint32),
+                np.repeat(np.arange(1, len(counts) + 1), counts))
+
+    @classmethod
+    def sample_sources(cls, graph, sources, pairs_per_distance=4, workers=None, seed=0):
+        """
+        Returns: (heads, tails, distances) arrays of the pairs sampled around every source, with
+        the searches spread over a pool of workers when there is more than one
+        """
+        global shared_graph_
+        jobs = [(int(source), pairs_per_distance, seed) for source in sources]
+        if workers > 1:
+            shared_graph_ = graph
+            pool = multiprocessing.Pool(workers)
+            try:
+                results = list(pool.imap_unordered(sample_source_pairs, jobs, chunksize=16))
+            finally:
+                pool.close()
+                pool.join()
+                shared_graph_ = None
+        else:
+            results = [cls.sample_source(graph, *job) for job in jobs]
+        if not results:
+            return np.empty(0, dtype=np.uint32), np.empty(0, dtype=np.uint32), np.empty(0, dtype=np.int64)
+        return tuple(np.concatenate(arrays) for arrays in zip(*results))
+
+    def distances(self):
+        return np.repeat(np.arange(len(self.offsets) - 1), np.diff(self.offsets))
+
+    def refresh(self, graph, num_sources, pairs_per_distance=4, workers=None, seed=0, stale=False, max_searches=None):
+        """
+        Returns: Pair_Index over graph with num_sources heads. Pairs of the current sources are
+        kept unless stale is set, when the graph has changed since they were searched and they
+        all become stale. Stale sources still in the graph are searched again before new sources
+        are drawn at random, and at most max_searches searches are run.
+        """
+        sources, heads, tails, distances = self.sources, self.heads, self.tails, self.distances()
+        pending = self.stale
+        if stale:
+            pending = np.concatenate([self.stale, self.sources])
+            sources = heads = tails = distances = np.empty(0, dtype=np.uint32)
+        pending = pending[graph.has_nodes(pending)]
+
+        wanted = max(0, num_sources - len(sources) - len(pending))
+        candidates = np.setdiff1d(graph.nodes(), np.concatenate([sources, pending]))
+        rnd = np.random.RandomState(seed)
+        fresh = rnd.choice(candidates, min(wanted, len(candidates)), replace=False) if wanted and len(candidates) else candidates[:0]
+        todo = np.concatenate([pending, fresh])[:max_searches]
+
+        new_heads, new_tails, new_distances = self.sample_sources(graph, todo, pairs_per_distance=pairs_per_distance, workers=workers, seed=seed)
+        return self.from_pairs(np.concatenate([sources, todo]),
+                               pending[len(todo):],
+                               np.concatenate([heads, new_heads]),
+                               np.concatenate([tails, new_tails]),
+                               np.concatenate([distances, new_distances]).astype(np.int64))
+
+    @classmethod
+    def empty(cls):
+        return cls.from_pairs([], [], [], [], np.empty(0, dtype=np.int64))
+
+    def count(self, min_distance, max_distance=None):
+        return Layers(self.tails, self.offsets).count(min_distance, max_distance)
+
+    def sample(self, rnd, min_distance, max_distance=None):
+        """
+        Returns: (head, tail) drawn uniformly from the pairs with min_distance <= distance <= max_distance,
+        None if there are none
+        """
+        start, stop = Layers(self.tails, self.offsets).span(min_distance, max_distance)
+        if start == stop:
+            return None
+        index = rnd.randrange(start, stop)
+        return int(self.heads[index]), int(self.tails[index])
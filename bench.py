@@ -0,0 +1,48 @@
+#! /usr/bin/env python
+import Bigrams
+import Graph
+import argparse
+import networkx as nx
+import numpy as np
+import random
+import time
+
+def bench(name, shortest_path, pairs):
+    start = time.time()
+    lengths = [len(shortest_path(ref1, ref2)) for ref1, ref2 in pairs]
+    elapsed = time.time() - start
+    print "%-10s %8.3fs %10.1fus/path" % (name, elapsed, 1e6 * elapsed / len(pairs))
+    return lengths
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Shortest path benchmark', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--dbname', '-d', default='wn_bacon')
+    parser.add_argument('--num_pairs', '-n', type=int, default=1000)
+    parser.add_argument('--seed', '-s', type=int, default=0)
+    parser.add_argument('--read_gpickle', '-rgp', action='store_true', help='gpickle')
+    parser.add_argument('--read_snapshot', '-rs', action='store_true', help='map graph snapshot')
+    parser.add_argument('--verify_snapshot', '-vs', action='store_true', help='check the checksum of mapped snapshot files, reading them whole')
+    parser.add_argument('--power_law', '-pl', type=int, default=0, help='benchmark a synthetic Barabasi-Albert graph of this many nodes instead of the database')
+    parser.add_argument('--power_law_edges', '-ple', type=int, default=3, help='edges added with each node of the synthetic graph')
+    args = parser.parse_args()
+
+    if args.power_law:
+        graph = nx.relabel_nodes(nx.barabasi_albert_graph(args.power_law, args.power_law_edges, seed=args.seed), lambda node: node + 1)
+        edges = np.array(graph.edges())
+        csr_graph = Graph.CSR_Graph.from_edges(edges[:, 0], edges[:, 1], np.arange(len(edges)))
+    else:
+        db = Bigrams.get_database(args.dbname)
+        db.verify_snapshots = args.verify_snapshot
+        graph = db.graph(read_gpickle=args.read_gpickle)
+        csr_graph = db.csr_graph(read_snapshot=args.read_snapshot)
+
+    rnd = random.Random(args.seed)
+    nodes = graph.nodes()
+    pairs = [(rnd.choice(nodes), rnd.choice(nodes)) for ii in range(args.num_pairs)]
+
+    print "Shortest paths between %d random pairs of %d nodes:" % (len(pairs), len(nodes))
+    nx_lengths = bench('networkx', lambda ref1, ref2: nx.shortest_path(graph, source=ref1, target=ref2), pairs)
+    csr_lengths = bench('csr', csr_graph.shortest_path, pairs)
+
+    mismatches = sum([nx_len != csr_len for nx_len, csr_len in zip(nx_lengths, csr_lengths)])
+    print "Path length mismatches: %d" % (mismatches)
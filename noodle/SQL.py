@@ -8,6 +8,7 @@ import MySQLdb
 import psycopg2
 import Tools
 from uuid import uuid1
+import tempfile
 import warnings
 import atexit
 
@@ -39,6 +40,7 @@ class connection(object):
         self.host = host
         self.user = user
         self.passwd = passwd
+        self.unix_socket = unix_socket
         self.type = type
 
         if type == 'psql':
@@ -63,6 +65,44 @@ class connection(object):
                         ",".join(ref.keys()),
                         ",".join(["'%s'" % (self.escape_string(ref[y]) if not Tools.is_int(ref[y]) else ref[y]) for y in ref.keys()])))
 
+    def quote(self, val):
+        """Return val as a SQL literal."""
+        if val is None:
+            return "NULL"
+        if isinstance(val, (int, long)):
+            return str(val)
+        return "'%s'" % (self.escape_string(val))
+
+    def insert_rows(self, tbl, flds, rows, ignore=False, batch_size=1000):
+        """Insert a list of row tuples using batched multi-row INSERT statements."""
+        for start in range(0, len(rows), batch_size):
+            self.execute("INSERT %s INTO %s (%s) VALUES %s"
+                         % ("IGNORE" if ignore else "",
+                            tbl,
+                            ",".join(flds),
+                            ",".join(["(%s)" % (",".join([self.quote(val) for val in row])) for row in rows[start:start + batch_size]])))
+
+    def infile_value(self, val):
+        """Return val formatted as a LOAD DATA INFILE field."""
+        if val is None:
+            return "\\N"
+        if isinstance(val, (int, long)):
+            return str(val)
+        return val.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+
+    def load_rows(self, tbl, flds, rows, ignore=False):
+        """Bulk load a list of row tuples using LOAD DATA LOCAL INFILE."""
+        fp = tempfile.NamedTemporaryFile(suffix='.tsv')
+        for row in rows:
+            fp.write("\t".join([self.infile_value(val) for val in row]) + "\n")
+        fp.flush()
+        self.execute("LOAD DATA LOCAL INFILE '%s' %s INTO TABLE %s (%s)"
+                     % (fp.name,
+                        "IGNORE" if ignore else "",
+                        tbl,
+                        ",".join(flds)))
+        fp.close()
+
     def on_exit(self):
         # print "[%s]: Closing %s" % (self.__class__, self.dbh)
         self.dbh.close()
@@ -133,12 +173,48 @@ class connection(object):
             self.alt_cursor = self.alt_dbh.cursor()
         return self.alt_cursor == None
 
+    def connect(self, **kwargs):
+        """Open a new MySQL connection to the currently selected database."""
+        if not self.unix_socket == "":
+            kwargs['unix_socket'] = self.unix_socket
+        return MySQLdb.connect(host=self.host, user=self.user, passwd=self.passwd, db=self.db_name, local_infile=1, **kwargs)
+
+    def stream(self, sql, assoc=False, batch_size=10000):
+        """Generator of rows read through an unbuffered server-side cursor.
+
+        Each stream uses its own connection, so rows can be consumed while this
+        connection executes other statements.
+        """
+        dbh = self.connect()
+        cursor = dbh.cursor(MySQLdb.cursors.SSDictCursor if assoc else MySQLdb.cursors.SSCursor)
+        try:
+            cursor.execute(sql)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+        finally:
+            cursor.close()
+            dbh.close()
+
+    def stream_all(self, sql):
+        return self.stream(sql)
+
+    def stream_assoc(self, sql):
+        return self.stream(sql, assoc=True)
+
     def get_row_cnt(self):
         return int(self.get_one("SELECT ROW_COUNT()"))
 
     def get_last_insert_id(self):
         return int(self.get_one("SELECT LAST_INSERT_ID()"))
 
+    def get_insert_id(self):
+        """Return the AUTO_INCREMENT id of the last insert without a round trip."""
+        return int(self.dbh.insert_id())
+
     def get_status_variable(self, var):
         """Return value of MySQL system variable referenced by name."""
         self.get_alt_cursor().execute("SHOW GLOBAL STATUS LIKE '%s'" % (self.get_like_pattern(var)))
@@ -1,9 +1,15 @@
 import ConfigParser
+import Queue
 import SQL
+import collections
+import contextlib
 import datetime
 from os import getenv
 import socket
 import re
+import sys
+import threading
+import time
 import warnings
 
 def timedelta(time_str):
@@ -18,6 +24,180 @@ def is_int(s):
         pass
     return False
 
+@contextlib.contextmanager
+def phase(name):
+    """Context manager printing a NOTE when a named phase starts and how long it took."""
+    print "NOTE: %s" % (name)
+    start = time.time()
+    yield
+    print "NOTE: %s took %.2fs" % (name, time.time() - start)
+
+def prefetch(iterable, maxsize=100, chunk_size=1000, timeout=0.1):
+    """Generator yielding the items of iterable, read ahead by a background thread.
+
+    Items are passed in chunks through a queue bounded to maxsize chunks, so memory
+    stays bounded while producing and consuming overlap. When the consumer stops early,
+    by closing the generator or raising, the reader, which polls a stop event every
+    timeout seconds while the queue is full, ends and iterable is closed.
+    """
+    queue = Queue.Queue(maxsize)
+    done = object()
+    error = []
+    stop = threading.Event()
+
+    def put(chunk):
+        while not stop.is_set():
+            try:
+                queue.put(chunk, timeout=timeout)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def reader():
+        try:
+            chunk = []
+            for item in iterable:
+                chunk.append(item)
+                if len(chunk) == chunk_size:
+                    if not put(chunk):
+                        return
+                    chunk = []
+            if chunk and not put(chunk):
+                return
+        except Exception:
+            error.append(sys.exc_info())
+        put(done)
+
+    thread = threading.Thread(target=reader)
+    thread.daemon = True
+    thread.start()
+
+    try:
+        while True:
+            chunk = queue.get()
+            if chunk is done:
+                break
+            for item in chunk:
+                yield item
+    finally:
+        stop.set()
+        thread.join()
+        if hasattr(iterable, 'close'):
+            iterable.close()
+
+    if error:
+        raise error[0][0], error[0][1], error[0][2]
+
+class Cache(object):
+    """Bounded key/value cache with hit, miss and eviction counters.
+
+    Once more than max_entries entries are held, or the total of sizeof(value)
+    exceeds max_size, the least recently used (policy 'lru') or least frequently
+    used (policy 'lfu', ties broken by recency) entries are evicted. The public
+    methods hold a reentrant lock, so one cache can be shared between threads.
+    """
+
+    POLICIES = ['lru', 'lfu']
+
+    def __init__(self, max_entries=None, max_size=None, sizeof=None, policy='lru'):
+        assert policy in self.POLICIES, 'policy: %s, is not a valid policy' % policy
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.sizeof = sizeof if not sizeof is None else (lambda value: 1)
+        self.policy = policy
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.entries_ = collections.OrderedDict()
+            self.counts_ = {}
+            self.buckets_ = {}
+            self.min_count_ = 0
+            self.size_ = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def touch(self, key):
+        if self.policy == 'lru':
+            self.entries_[key] = self.entries_.pop(key)
+        else:
+            count = self.counts_[key]
+            self.unlink(key)
+            self.link(key, count + 1)
+
+    def link(self, key, count):
+        self.counts_[key] = count
+        self.buckets_.setdefault(count, collections.OrderedDict())[key] = True
+        if count == 1 or len(self.counts_) == 1:
+            self.min_count_ = count
+
+    def unlink(self, key):
+        count = self.counts_.pop(key)
+        del self.buckets_[count][key]
+        if not self.buckets_[count]:
+            del self.buckets_[count]
+            if self.min_count_ == count:
+                self.min_count_ = count + 1
+        return count
+
+    def remove(self, key):
+        """Remove key and return its use count."""
+        self.size_ -= self.sizeof(self.entries_.pop(key))
+        return self.unlink(key) if self.policy == 'lfu' else 0
+
+    def evict(self):
+        if self.policy == 'lru':
+            key = next(iter(self.entries_))
+        else:
+            if not self.min_count_ in self.buckets_:
+                self.min_count_ = min(self.buckets_)
+            key = next(iter(self.buckets_[self.min_count_]))
+        self.remove(key)
+        self.evictions += 1
+
+    def is_full(self, size):
+        return ((not self.max_entries is None and len(self.entries_) + 1 > self.max_entries) or
+                (not self.max_size is None and self.size_ + size > self.max_size))
+
+    def get(self, key, default=None):
+        with self.lock:
+            if not key in self.entries_:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self.touch(key)
+            return self.entries_[key]
+
+    def put(self, key, value):
+        with self.lock:
+            count = self.remove(key) if key in self.entries_ else 0
+            size = self.sizeof(value)
+            while self.entries_ and self.is_full(size):
+                self.evict()
+            self.entries_[key] = value
+            self.size_ += size
+            if self.policy == 'lfu':
+                self.link(key, count + 1)
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries_
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries_)
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries_),
+                    'size': self.size_,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions}
+
 class atts(object):
     def __init__(self, kwargs):
         for key, val in kwargs.items():
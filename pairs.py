@@ -0,0 +1,25 @@
+#! /usr/bin/env python
+import Bigrams
+import argparse
+import multiprocessing
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build or refresh the pair index of puzzle (head, tail) pairs', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--dbname', '-d', default='wn_bacon')
+    parser.add_argument('--num_sources', '-n', type=int, default=10000, help='number of breadth first search sources (heads)')
+    parser.add_argument('--pairs_per_distance', '-k', type=int, default=4, help='tails kept per source and distance')
+    parser.add_argument('--max_searches', '-x', type=int, default=None, help='maximum number of searches in this run')
+    parser.add_argument('--workers', '-w', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--seed', '-s', type=int, default=0)
+    parser.add_argument('--read_snapshot', '-rs', action='store_true', help='map graph snapshot')
+    parser.add_argument('--verify_snapshot', '-vs', action='store_true', help='check the checksum of mapped snapshot files, reading them whole')
+    args = parser.parse_args()
+
+    db = Bigrams.get_database(args.dbname)
+    db.verify_snapshots = args.verify_snapshot
+    graph = db.csr_graph(read_snapshot=args.read_snapshot)
+    index = db.pair_index(graph, args.num_sources, pairs_per_distance=args.pairs_per_distance, workers=args.workers, seed=args.seed,
+                          max_searches=args.max_searches)
+
+    for distance in range(1, len(index.offsets) - 1):
+        print "%3d: %d pairs" % (distance, index.count(distance, distance))
@@ -17,7 +17,10 @@ class Puzzle(object):
 
     def head(self):
         if self.head_ is None:
-            self.head_ = self.game_api.random_node()
+            if self.tail_ is None:
+                self.head_, self.tail_ = self.game_api.random_pair_by_distance(self.min_distance, self.max_distance)
+            else:
+                self.head_ = self.game_api.random_node()
         return self.head_
 
     def tail(self):
@@ -223,7 +226,8 @@ class Game(object):
     MOVE = 1
     DELETE = 2
 
-    def __init__(self, mode, dbname, head_word=None, tail_word=None, read_gpickle=False, write_gpickle=False, cmd_list=None):
+    def __init__(self, mode, dbname, head_word=None, tail_word=None, read_gpickle=False, write_gpickle=False, cmd_list=None, engine='networkx', read_snapshot=False, write_snapshot=False, landmarks=0,
+                 pair_index=False, verify_snapshot=False):
         self.mode = mode
         self.dbname = dbname
         self.head_word = head_word
@@ -231,6 +235,12 @@ class Game(object):
         self.cmd_list = cmd_list
         self.read_gpickle = read_gpickle
         self.write_gpickle = write_gpickle
+        self.engine = engine
+        self.read_snapshot = read_snapshot
+        self.write_snapshot = write_snapshot
+        self.landmarks = landmarks
+        self.pair_index = pair_index
+        self.verify_snapshot = verify_snapshot
 
         self.game_api_ = None
 
@@ -385,7 +395,9 @@ class Game(object):
 
     def game_api(self):
         if self.game_api_ is None:
-            self.game_api_ = Bigrams.Game_API(self.dbname, read_gpickle=self.read_gpickle, write_gpickle=self.write_gpickle)
+            self.game_api_ = Bigrams.Game_API(self.dbname, read_gpickle=self.read_gpickle, write_gpickle=self.write_gpickle, engine=self.engine,
+                                              read_snapshot=self.read_snapshot, write_snapshot=self.write_snapshot, landmarks=self.landmarks,
+                                              pair_index=self.pair_index, verify_snapshot=self.verify_snapshot)
         return self.game_api_
 
     def puzzle(self):
@@ -437,6 +449,12 @@ if __name__ == '__main__':
     parser.add_argument('--cmd_file', '-c')
     parser.add_argument('--write_gpickle', '-wgp', action='store_true', help='verbose')
     parser.add_argument('--read_gpickle', '-rgp', action='store_true', help='verbose')
+    parser.add_argument('--engine', '-e', default='networkx', choices=Bigrams.Game_API.ENGINES, help='graph engine')
+    parser.add_argument('--read_snapshot', '-rs', action='store_true', help='map graph snapshot (implies csr engine)')
+    parser.add_argument('--write_snapshot', '-ws', action='store_true', help='write graph snapshot (implies csr engine)')
+    parser.add_argument('--verify_snapshot', '-vs', action='store_true', help='check the checksum of mapped snapshot files, reading them whole')
+    parser.add_argument('--landmarks', '-l', type=int, default=0, help='number of landmarks for distance lookups (implies csr engine)')
+    parser.add_argument('--pair_index', '-pi', action='store_true', help='draw puzzles from the pair index built by pairs.py')
     args = parser.parse_args()
 
     cmd_list = None
@@ -454,5 +472,11 @@ if __name__ == '__main__':
                 tail_word=args.tail_word,
                 read_gpickle=args.read_gpickle,
                 write_gpickle=args.write_gpickle,
-                cmd_list=cmd_list)
+                cmd_list=cmd_list,
+                engine=args.engine,
+                read_snapshot=args.read_snapshot,
+                write_snapshot=args.write_snapshot,
+                landmarks=args.landmarks,
+                pair_index=args.pair_index,
+                verify_snapshot=args.verify_snapshot)
     game.start()
@@ -1,8 +1,20 @@
 #! /usr/bin/env python
 import API
+import Bigrams
+import Queue
 import argparse
+import errno
+import gc
+import os
+import random
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
 from wsgiref.util import setup_testing_defaults
-from wsgiref.simple_server import make_server
+from wsgiref.simple_server import make_server, ServerHandler, WSGIRequestHandler, WSGIServer
 
 DEFAULT_PORT = 8080
 DEFAULT_DBNAME = "wn_bacon"
@@ -14,32 +26,297 @@ def get_doc():
 
 def application(environ, start_response):
     setup_testing_defaults(environ)
-    api.set_environ(environ)
+    request = API.Request(environ)
+    # read the whole body up front so that a kept alive connection is left at the start of the next request
+    request.body()
 
     status = '200 OK'
     headers = [('Content-type', 'text/plain')]
 
     try:
-        if api._get_page() == 'doc':
+        if request.page() == 'doc':
             content = get_doc()
             headers = [('Content-type', 'text/html')]
         else:
-            content = api._application()
             headers = [('Content-type', 'application/json'), ('Access-Control-Allow-Origin', '*')]
+            etag = api._etag(request)
+            if not etag is None and (etag in request.if_none_match() or '*' in request.if_none_match()):
+                status = '304 Not Modified'
+                content = []
+            else:
+                # etag is None unless the response is a cacheable success, so errors are never cached downstream
+                content, etag = api._respond(request)
+            if not etag is None:
+                headers += [('ETag', etag), ('Cache-Control', 'public, max-age=%d' % (args.max_age))]
     except AttributeError:
         status = '204 No Content'
         content = []
 
+    if not status[:3] in Server_Handler.BODILESS:
+        headers.append(('Content-Length', str(sum([len(chunk) for chunk in content]))))
     start_response(status, headers)
     return content
 
+class Server_Handler(ServerHandler):
+    """
+    Answers in HTTP/1.1, closing the connection when its request handler does not keep connections
+    alive or after any response whose length is not known up front
+    """
+    http_version = '1.1'
+    # statuses whose responses never have a body, nor a Content-Length
+    BODILESS = ['204', '304']
+
+    def cleanup_headers(self):
+        ServerHandler.cleanup_headers(self)
+        if not self.request_handler.keep_alive or (not 'Content-Length' in self.headers and not self.status[:3] in self.BODILESS):
+            self.headers['Connection'] = 'close'
+            self.request_handler.close_connection = 1
+
+    def finish_content(self):
+        # wsgiref would announce an empty body with Content-Length: 0
+        if not self.headers_sent and self.status[:3] in self.BODILESS:
+            self.send_headers()
+            return
+        ServerHandler.finish_content(self)
+
+class Request_Handler(WSGIRequestHandler):
+    """
+    Serves requests on one connection until the client closes it, asks to close it, or leaves it
+    idle for longer than timeout seconds. Without keep_alive every connection serves one request.
+    """
+    protocol_version = 'HTTP/1.1'
+    keep_alive = True
+
+    def handle(self):
+        self.close_connection = 1
+        self.handle_one_request()
+        while self.keep_alive and not self.close_connection:
+            self.handle_one_request()
+
+    def handle_one_request(self):
+        try:
+            self.raw_requestline = self.rfile.readline(65537)
+        except socket.error:
+            # idle past the timeout or reset by the client
+            self.close_connection = 1
+            return
+        if len(self.raw_requestline) > 65536:
+            self.requestline = ''
+            self.request_version = ''
+            self.command = ''
+            self.send_error(414)
+            self.close_connection = 1
+            return
+        if not self.raw_requestline:
+            self.close_connection = 1
+            return
+        if not self.parse_request():
+            return
+
+        handler = Server_Handler(self.rfile, self.wfile, self.get_stderr(), self.get_environ())
+        handler.request_handler = self
+        handler.run(self.server.get_app())
+
+class Pooled_WSGI_Server(WSGIServer):
+    """
+    WSGIServer that hands each accepted connection to one of num_threads worker threads through a
+    bounded queue, so one slow request no longer holds up every other client
+    """
+    request_queue_size = 128
+
+    def __init__(self, server_address, handler_class, num_threads, queue_size=None):
+        WSGIServer.__init__(self, server_address, handler_class)
+        self.num_threads = num_threads
+        self.connections = Queue.Queue(queue_size if not queue_size is None else 4 * num_threads)
+        self.workers = []
+        self.active = 0
+        self.active_lock = threading.Lock()
+
+    def start_workers(self):
+        # threads do not survive a fork, so each serving process starts its own
+        for ii in range(self.num_threads):
+            worker = threading.Thread(target=self.process_connections, name='worker-%d' % (ii))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def stop_workers(self):
+        """
+        Let the workers finish the connections already queued, then wait for them to exit
+        """
+        for worker in self.workers:
+            self.connections.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+
+    def is_busy(self):
+        """
+        Returns: True when every worker thread already has a connection to serve
+        """
+        return self.active >= self.num_threads
+
+    def process_request(self, request, client_address):
+        with self.active_lock:
+            self.active += 1
+        self.connections.put((request, client_address))
+
+    def process_connections(self):
+        while True:
+            connection = self.connections.get()
+            if connection is None:
+                return
+            request, client_address = connection
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+                with self.active_lock:
+                    self.active -= 1
+
+class Prefork_Server(object):
+    """
+    Master of num_processes forked workers that all accept connections on httpd's listening socket.
+    Everything loaded before serve_forever() is shared with the workers copy-on-write, or through
+    the page cache for a mapped snapshot. A worker that dies is replaced. SIGTERM or SIGINT stops
+    the workers once their current requests are done, and then the master exits.
+    """
+    BACKLOG = 128
+    POLL_INTERVAL = 0.5
+    BUSY_INTERVAL = 0.005
+    RESPAWN_DELAY = 1.0
+
+    def __init__(self, httpd, num_processes, after_fork=None):
+        self.httpd = httpd
+        self.num_processes = num_processes
+        self.after_fork = after_fork
+        self.pids = {}
+        self.stopping = False
+
+    def stop(self, signum, frame):
+        self.stopping = True
+
+    def serve_forever(self):
+        # workers race for each connection, and the losers must go back to polling rather than block in accept()
+        self.httpd.socket.setblocking(0)
+        self.httpd.socket.listen(self.BACKLOG)
+        # collect now so that the workers do not all write to the pages of the garbage they inherit
+        gc.collect()
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for ii in range(self.num_processes):
+            self.spawn()
+
+        signalled = False
+        while self.pids:
+            if self.stopping and not signalled:
+                for pid in self.pids:
+                    os.kill(pid, signal.SIGTERM)
+                signalled = True
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as exc:
+                if exc.errno != errno.EINTR:
+                    raise
+                continue
+            if not pid:
+                time.sleep(self.POLL_INTERVAL)
+                continue
+            started = self.pids.pop(pid)
+            if not self.stopping:
+                if os.WIFSIGNALED(status):
+                    print "NOTE: Worker %d was killed by signal %d, restarting it" % (pid, os.WTERMSIG(status))
+                else:
+                    print "NOTE: Worker %d exited with code %d, restarting it" % (pid, os.WEXITSTATUS(status))
+                if time.time() - started < self.RESPAWN_DELAY:
+                    time.sleep(self.RESPAWN_DELAY)
+                self.spawn()
+        print "NOTE: All workers stopped"
+
+    def spawn(self):
+        pid = os.fork()
+        if pid:
+            self.pids[pid] = time.time()
+            return
+        status = 0
+        try:
+            self.work()
+        except Exception:
+            traceback.print_exc()
+            status = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(status)
+
+    def work(self):
+        self.pids = {}
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        # otherwise every worker would draw the same "random" nodes
+        random.seed()
+        if not self.after_fork is None:
+            self.after_fork()
+        pooled = isinstance(self.httpd, Pooled_WSGI_Server)
+        if pooled:
+            self.httpd.start_workers()
+        self.httpd.timeout = self.POLL_INTERVAL
+        while not self.stopping:
+            if pooled and self.httpd.is_busy():
+                # leave new connections to a worker with an idle thread
+                time.sleep(self.BUSY_INTERVAL)
+                continue
+            self.httpd.handle_request()
+        if pooled:
+            self.httpd.stop_workers()
+
 parser = argparse.ArgumentParser(description='Bigram Server', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 parser.add_argument('--port', '-p', type=int, default=DEFAULT_PORT)
 parser.add_argument('--dbname', '-d', default=DEFAULT_DBNAME)
 parser.add_argument('--read_gpickle', '-rgp', action='store_true', help='gpickle')
+parser.add_argument('--engine', '-e', default='networkx', choices=API.API.ENGINES, help='graph engine')
+parser.add_argument('--read_snapshot', '-rs', action='store_true', help='map graph snapshot (implies csr engine)')
+parser.add_argument('--write_snapshot', '-ws', action='store_true', help='write graph snapshot (implies csr engine)')
+parser.add_argument('--verify_snapshot', '-vs', action='store_true', help='check the checksum of mapped snapshot files, reading them whole')
+parser.add_argument('--landmarks', '-l', type=int, default=0, help='number of landmarks for distance lookups (implies csr engine)')
+parser.add_argument('--path_cache_entries', '-pce', type=int, default=100000, help='maximum number of cached shortest paths')
+parser.add_argument('--path_cache_size', '-pcs', type=int, default=None, help='maximum approximate bytes of cached shortest paths')
+parser.add_argument('--path_cache_policy', '-pcp', default='lru', choices=Bigrams.nt.Tools.Cache.POLICIES, help='path cache eviction policy')
+parser.add_argument('--layer_cache_entries', '-lce', type=int, default=100, help='maximum number of refs whose distance layers are cached')
+parser.add_argument('--pair_index', '-pi', action='store_true', help='draw random pairs from the pair index built by pairs.py')
+parser.add_argument('--glosses', '-g', default='lazy', choices=API.API.GLOSS_MODES, help='gloss lookup: lazy (cached queries) or store (bulk loaded, written with --write_snapshot)')
+parser.add_argument('--gloss_cache_entries', '-gce', type=int, default=100000, help='maximum number of cached glosses in lazy mode')
+parser.add_argument('--response_cache_entries', '-rce', type=int, default=10000, help='maximum number of cached responses of deterministic services')
+parser.add_argument('--response_cache_size', '-rcs', type=int, default=None, help='maximum bytes of cached responses')
+parser.add_argument('--max_age', '-ma', type=int, default=3600, help='seconds clients and proxies may reuse a response of a deterministic service')
+parser.add_argument('--threads', '-t', type=int, default=0, help='number of worker threads serving requests (0 serves one request at a time)')
+parser.add_argument('--keep_alive_timeout', '-kat', type=float, default=5.0, help='seconds an idle kept alive connection holds a worker thread')
+parser.add_argument('--processes', '-P', type=int, default=0, help='number of forked worker processes sharing the loaded graph (0 serves from this process)')
 args = parser.parse_args()
 
-api = API.API(args.dbname, read_gpickle=args.read_gpickle)
-httpd = make_server('', args.port, application)
-print "Serving %s on port %d..." % (args.dbname, args.port)
-httpd.serve_forever()
+api = API.API(args.dbname, read_gpickle=args.read_gpickle, engine=args.engine, read_snapshot=args.read_snapshot, write_snapshot=args.write_snapshot,
+              landmarks=args.landmarks, path_cache_entries=args.path_cache_entries, path_cache_size=args.path_cache_size,
+              path_cache_policy=args.path_cache_policy, layer_cache_entries=args.layer_cache_entries,
+              pair_index=args.pair_index, glosses=args.glosses, gloss_cache_entries=args.gloss_cache_entries,
+              response_cache_entries=args.response_cache_entries, response_cache_size=args.response_cache_size,
+              verify_snapshot=args.verify_snapshot)
+print "NOTE: Graph version %s" % (api.graph_version())
+if args.threads:
+    Request_Handler.timeout = args.keep_alive_timeout
+    httpd = Pooled_WSGI_Server(('', args.port), Request_Handler, args.threads)
+    httpd.set_app(application)
+    print "Serving %s on port %d with %d threads..." % (args.dbname, args.port, args.threads)
+else:
+    # a lone thread would be held by an idle kept alive connection
+    Request_Handler.keep_alive = False
+    httpd = make_server('', args.port, application, handler_class=Request_Handler)
+    print "Serving %s on port %d..." % (args.dbname, args.port)
+if args.processes:
+    print "NOTE: Forking %d worker processes" % (args.processes)
+    Prefork_Server(httpd, args.processes, after_fork=api._db().reset_dbh).serve_forever()
+else:
+    if args.threads:
+        httpd.start_workers()
+    httpd.serve_forever()
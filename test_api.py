@@ -0,0 +1,69 @@
+#! /usr/bin/env python
+"""
+Checks of the batch service's resolution of references to earlier results.
+
+    python -m unittest test_api
+"""
+import API
+import StringIO
+import json
+import sys
+import unittest
+import urllib
+
+class Batch_API(API.API):
+    """
+    API with two services of fixed results and no graph behind them
+    """
+
+    BATCH_OPS = ['path', 'echo']
+
+    def __init__(self):
+        pass
+
+    def path_(self, request):
+        return {'path': [3, 4, 5], 'head': {'ref': 3, 'word': u'caf\xe9'}, 'found': True, 'gloss': None}
+
+    def echo_(self, request):
+        return dict([(key, vals[0]) for key, vals in request.args().items()])
+
+class Test_Batch(unittest.TestCase):
+
+    def setUp(self):
+        self.api = Batch_API()
+        # errors trace to stderr
+        self.stderr = sys.stderr
+        sys.stderr = StringIO.StringIO()
+
+    def tearDown(self):
+        sys.stderr = self.stderr
+
+    def batch(self, ops):
+        request = API.Request({'PATH_INFO': '/batch', 'QUERY_STRING': urllib.urlencode({'ops': json.dumps(ops)})})
+        return self.api._run(self.api.batch_, request)
+
+    def test_refs(self):
+        args = {'path': '$0.path', 'ref': '$0.path.1', 'head': '$0.head.ref', 'word': '$0.head.word', 'found': '$0.found',
+                'gloss': '$0.gloss', 'refs': [1, '$0.path.2'], 'literal': 7}
+        results = self.batch([{'op': 'path'}, {'op': 'echo', 'args': args}, {'op': 'echo', 'args': {'ref': '$1.ref'}}])['results']
+        self.assertEqual(results[1], {'path': '3,4,5', 'ref': '4', 'head': '3', 'word': 'caf\xc3\xa9', 'found': 'true',
+                                      'gloss': '', 'refs': '1,5', 'literal': '7'})
+        self.assertEqual(results[2], {'ref': '4'})
+
+    def test_bad_refs(self):
+        # $1 is the error of an unknown op, $2 the op itself
+        bad = ['$1.ref', '$2.path', '$3.path', '$-1.path', '$x.path', '$0.missing', '$0.path.7', '$0.path.ref', '$0.head.ref.0']
+        ops = [{'op': 'path'}, {'op': 'unknown'}] + [{'op': 'echo', 'args': {'ref': ref}} for ref in bad]
+        results = self.batch(ops)['results']
+        self.assertEqual(results[0]['path'], [3, 4, 5])
+        for result in results[1:]:
+            self.assertEqual(result['error'], API.InvalidArgError.ERROR_CODE)
+
+    def test_bad_ops(self):
+        for ops in [{'op': 'path'}, [{'op': 'path'}] * (Batch_API.MAX_BATCH_OPS + 1)]:
+            self.assertEqual(self.batch(ops)['error'], API.InvalidArgError.ERROR_CODE)
+        results = self.batch([{'op': 'echo', 'args': [1]}, 'path'])['results']
+        self.assertEqual([result['error'] for result in results], [API.InvalidArgError.ERROR_CODE] * 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+#! /usr/bin/env python
+"""
+Checks of edge ingestion, row by row and in bulk, against an in-memory database, and of
+the path cache.
+
+    python -m unittest test_bigrams
+"""
+import Bigrams
+import sqlite3
+import unittest
+
+SCHEMA = [
+    "CREATE TABLE words (word_id INTEGER PRIMARY KEY, word TEXT COLLATE NOCASE UNIQUE)",
+    "CREATE TABLE senses (sense_id INTEGER PRIMARY KEY, word_id INTEGER NOT NULL, ref_sense_id INTEGER)",
+    "CREATE TABLE bigrams (bigram_id INTEGER PRIMARY KEY, sense1_id INTEGER, sense2_id INTEGER, link_id INTEGER, relation_id INTEGER, UNIQUE (sense1_id, sense2_id, link_id))",
+    "CREATE TABLE links (link_id INTEGER PRIMARY KEY, link TEXT COLLATE NOCASE UNIQUE)",
+    "CREATE TABLE relations (relation_id INTEGER PRIMARY KEY, relation TEXT UNIQUE)",
+    "CREATE TABLE config (attribute TEXT PRIMARY KEY, value TEXT)",
+    "CREATE TABLE directed_edges (sense1_id INTEGER, sense2_id INTEGER, UNIQUE (sense1_id, sense2_id))",
+    "INSERT INTO config VALUES ('directed', 'False')",
+    ]
+
+class Connection(object):
+    """
+    Stand-in for nt.SQL.connection on sqlite, whose words and links compare case
+    insensitively like MySQL's default collation
+    """
+
+    def __init__(self):
+        self.dbh = sqlite3.connect(':memory:')
+        self.cursor = self.dbh.cursor()
+        self.insert_id = 0
+        for sql in SCHEMA:
+            self.execute(sql)
+
+    def execute(self, sql):
+        self.cursor.execute(sql.replace('INSERT IGNORE', 'INSERT OR IGNORE'))
+        # like MySQL's, 0 unless the statement inserted a row
+        self.insert_id = self.cursor.lastrowid if sql.startswith('INSERT') and self.cursor.rowcount > 0 else 0
+
+    def escape_string(self, str):
+        return str.replace("'", "''")
+
+    def get_insert_id(self):
+        return self.insert_id
+
+    def insert_rows(self, tbl, flds, rows, ignore=False):
+        self.cursor.executemany("INSERT %s INTO %s (%s) VALUES (%s)" % ("OR IGNORE" if ignore else "", tbl, ','.join(flds), ','.join(['?'] * len(flds))), rows)
+
+    def load_rows(self, tbl, flds, rows, ignore=False):
+        self.insert_rows(tbl, flds, rows, ignore=ignore)
+
+    def get_all(self, sql):
+        self.execute(sql)
+        return self.cursor.fetchall()
+
+    def get_list(self, sql):
+        return [val[0] for val in self.get_all(sql)]
+
+    def get_one(self, sql):
+        rows = self.get_all(sql)
+        return rows[0][0] if rows else None
+
+    def get_dict(self, sql):
+        return dict(self.get_all(sql))
+
+def ingest(row_str, col_str, bulk=None, batch_size=3):
+    """
+    Returns: Connection holding the grid of row_str by col_str ingested row by row, or in bulk
+    with method bulk and batches of batch_size rows
+    """
+    db = Bigrams.Grid_Database('test', row_str, col_str)
+    db.dbhs_.dbh = Connection()
+    if not bulk is None:
+        db.bulk_loader_ = Bigrams.Bulk_Loader(db, method=bulk, batch_size=batch_size)
+    db.insert_into_db(bulk=bulk, prefetch=False)
+    return db.dbh()
+
+class Test_Edge_Set(unittest.TestCase):
+
+    def test_undirected(self):
+        edges = Bigrams.Edge_Set(directed=False)
+        edges.load([(1, 2)])
+        self.assertFalse(edges.add(2, 1))
+        self.assertTrue(edges.add(2, 3))
+        self.assertFalse(edges.add(3, 2))
+        self.assertEqual(sorted(edges.pop_new_pairs()), [(2, 3), (3, 2)])
+        self.assertEqual(edges.pop_new_pairs(), [])
+        self.assertEqual(len(edges), 3)
+
+    def test_directed(self):
+        edges = Bigrams.Edge_Set(directed=True)
+        self.assertTrue(edges.add(1, 2))
+        self.assertTrue(edges.add(2, 1))
+        self.assertFalse(edges.add(1, 2))
+        # ids up to the full width of a sense_id column
+        self.assertTrue(edges.add(2 ** 32 - 1, 0))
+        self.assertTrue(edges.add(0, 2 ** 32 - 1))
+        self.assertEqual(edges.pop_new_pairs(), [(1, 2), (2, 1), (2 ** 32 - 1, 0), (0, 2 ** 32 - 1)])
+
+class Test_Interner(unittest.TestCase):
+
+    def test_preload(self):
+        db = Bigrams.Grid_Database('test', 'a', 'b')
+        db.dbhs_.dbh = Connection()
+        db.dbh().execute("INSERT INTO words VALUES (7, 'known')")
+        interner = db.interner('words')
+        self.assertTrue(interner is db.interner('words'))
+        self.assertEqual((len(interner), interner.get('known'), interner.get('new')), (1, 7, None))
+        # known words are answered from the cache, new ones written once
+        self.assertEqual(db.insert_word(None, 'known'), 7)
+        word_id = db.insert_word(None, 'new')
+        db.dbh().execute("DELETE FROM words")
+        self.assertEqual(db.insert_word(None, 'new'), word_id)
+        self.assertTrue('new' in interner)
+        self.assertEqual(db.interner('links').get('new'), None)
+
+class Test_Path_Cache(unittest.TestCase):
+
+    def test_undirected(self):
+        cache = Bigrams.Path_Cache(directed=False, max_entries=10)
+        cache.put((5, 2), [5, 7, 2])
+        # both directions share the entry, stored from the lower ref
+        self.assertEqual(cache.entries_.keys(), [(2, 5)])
+        self.assertEqual(cache.get((2, 5)), [2, 7, 5])
+        self.assertEqual(cache.get((5, 2)), [5, 7, 2])
+        cache.put((2, 5), [2, 8, 5])
+        self.assertEqual(len(cache.entries_), 1)
+        self.assertEqual(cache.get((5, 2)), [5, 8, 2])
+        self.assertEqual(cache.get((5, 3), 'missing'), 'missing')
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+
+    def test_directed(self):
+        cache = Bigrams.Path_Cache(directed=True, max_entries=10)
+        cache.put((5, 2), [5, 7, 2])
+        self.assertIsNone(cache.get((2, 5)))
+        self.assertEqual(cache.get((5, 2)), [5, 7, 2])
+
+    def test_max_size(self):
+        size = Bigrams.Path_Cache(directed=False).path_size([10, 11, 0])
+        cache = Bigrams.Path_Cache(directed=False, max_size=3 * size)
+        for ref in range(4):
+            cache.put((10, ref), [10, 11, ref])
+        self.assertEqual(sorted(cache.entries_), [(1, 10), (2, 10), (3, 10)])
+
+class Test_Bulk_Loader(unittest.TestCase):
+
+    def tables(self, dbh):
+        """
+        Returns: (words, senses, bigrams) of dbh by name, with the senses whose word is missing
+        """
+        return (sorted(dbh.get_list("SELECT word FROM words")),
+                sorted(dbh.get_all("SELECT sense_id, word FROM senses LEFT JOIN words USING (word_id)")),
+                sorted(dbh.get_all("SELECT w1.word, w2.word, link FROM bigrams"
+                                   " JOIN senses s1 ON s1.sense_id=sense1_id JOIN words w1 ON w1.word_id=s1.word_id"
+                                   " JOIN senses s2 ON s2.sense_id=sense2_id JOIN words w2 ON w2.word_id=s2.word_id"
+                                   " JOIN links USING (link_id)")))
+
+    def test_collation(self):
+        # the words of row A are case variants of those of row a, which the words table ignores
+        words, senses, bigrams = self.tables(ingest('aA', 'bc'))
+        self.assertEqual(words, ['ab', 'ac'])
+        self.assertFalse([sense for sense in senses if sense[1] is None])
+        for method in Bigrams.Bulk_Loader.METHODS:
+            for batch_size in [1, 3, 1000]:
+                self.assertEqual(self.tables(ingest('aA', 'bc', bulk=method, batch_size=batch_size)), (words, senses, bigrams))
+
+    def test_grid(self):
+        tables = self.tables(ingest('abc', 'de'))
+        self.assertEqual(len(tables[2]), 7)
+        self.assertEqual(self.tables(ingest('abc', 'de', bulk='insert')), tables)
+
+if __name__ == '__main__':
+    unittest.main()
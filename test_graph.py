@@ -0,0 +1,318 @@
+#! /usr/bin/env python
+"""
+Checks of the csr graph engine against networkx, of its lexicon, gloss store and pair index,
+and of snapshot files.
+
+    python -m unittest test_graph
+"""
+import Graph
+import json
+import networkx as nx
+import numpy as np
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+def random_graph(rnd, trial):
+    """
+    Returns: (nx_graph, csr_graph) of a sparse random graph, usually of several components,
+    whose nodes are refs from 1 up
+    """
+    graph = nx.gnm_random_graph(rnd.randint(2, 60), rnd.randint(1, 90), seed=trial)
+    graph.remove_nodes_from([node for node in graph.nodes() if graph.degree(node) == 0])
+    graph = nx.relabel_nodes(graph, lambda node: node + 1)
+    edges = np.array(graph.edges(), dtype=np.uint32).reshape(-1, 2)
+    csr_graph = Graph.CSR_Graph.from_edges(edges[:, 0], edges[:, 1], np.arange(len(edges), dtype=np.uint32), largest_component=False)
+    return graph, csr_graph
+
+class Test_Distances(unittest.TestCase):
+
+    TRIALS = 40
+
+    def graphs(self):
+        rnd = random.Random(0)
+        for trial in range(self.TRIALS):
+            graph, csr_graph = random_graph(rnd, trial)
+            if graph.number_of_edges():
+                yield rnd, graph, csr_graph, nx.all_pairs_shortest_path_length(graph)
+
+    def test_bfs(self):
+        for rnd, graph, csr_graph, lengths in self.graphs():
+            refs = graph.nodes()
+            for ref in refs:
+                self.assertEqual(csr_graph.distances(ref, refs), [lengths[ref].get(other) for other in refs])
+
+    def test_out_of_range(self):
+        # refs that would wrap onto node 20 when cast to uint32
+        graph = Graph.CSR_Graph.from_edges([1, 2, 20], [2, 20, 3], [0, 1, 2])
+        refs = [2 ** 32 + 20, 20, -(2 ** 32) + 20, 2 ** 70, 20.5]
+        self.assertEqual(graph.has_nodes(refs).tolist(), [False, True, False, False, False])
+        self.assertEqual(graph.distances(1, refs), [None, 2, None, None, None])
+        self.assertEqual(graph.distances(2 ** 32 + 1, refs), [None] * len(refs))
+
+    def test_bidirectional(self):
+        for rnd, graph, csr_graph, lengths in self.graphs():
+            for ref1 in graph.nodes():
+                for ref2 in graph.nodes():
+                    path = csr_graph.shortest_path(ref1, ref2)
+                    if not ref2 in lengths[ref1]:
+                        self.assertIsNone(path)
+                        continue
+                    self.assertEqual(len(path) - 1, lengths[ref1][ref2])
+                    self.assertEqual((path[0], path[-1]), (ref1, ref2))
+                    self.assertTrue(all(graph.has_edge(*edge) for edge in zip(path, path[1:])))
+
+    def test_hubs(self):
+        # hubs of more than HUB_DEGREE neighbors are searched with numpy rather than the Python loop
+        rnd = random.Random(2)
+        graph = nx.gnm_random_graph(600, 700, seed=2)
+        for hub in range(4):
+            graph.add_edges_from((hub, node) for node in rnd.sample(range(4, 600), Graph.Path_Finder.HUB_DEGREE + 20))
+        graph = nx.relabel_nodes(graph, lambda node: node + 1)
+        edges = np.array(graph.edges(), dtype=np.uint32)
+        csr_graph = Graph.CSR_Graph.from_edges(edges[:, 0], edges[:, 1], np.arange(len(edges), dtype=np.uint32))
+        refs = [int(ref) for ref in csr_graph.node_ids]
+        for ref1 in rnd.sample(refs, 30):
+            lengths = nx.single_source_shortest_path_length(graph, ref1)
+            self.assertEqual(csr_graph.distances(ref1, refs), [lengths[ref] for ref in refs])
+            for ref2 in rnd.sample(refs, 30):
+                path = csr_graph.shortest_path(ref1, ref2)
+                self.assertEqual(len(path) - 1, lengths[ref2])
+                self.assertEqual((path[0], path[-1]), (ref1, ref2))
+                self.assertTrue(all(graph.has_edge(*edge) for edge in zip(path, path[1:])))
+
+    def test_cutoff(self):
+        for rnd, graph, csr_graph, lengths in self.graphs():
+            for ref1 in graph.nodes():
+                for ref2, length in lengths[ref1].items():
+                    # the cutoff is an upper bound on the distance, such as a landmark's
+                    cutoff = length + rnd.randint(0, 2)
+                    self.assertEqual(csr_graph.path_finder().distance(csr_graph.index(ref1), csr_graph.index(ref2), cutoff=cutoff), length)
+
+    def test_landmarks(self):
+        for rnd, graph, csr_graph, lengths in self.graphs():
+            landmarks = Graph.Landmarks.build(csr_graph, num_landmarks=rnd.randint(1, 6))
+            for ref1 in graph.nodes():
+                for ref2 in graph.nodes():
+                    length = lengths[ref1].get(ref2)
+                    lower, upper = landmarks.bounds(ref1, ref2)
+                    self.assertEqual(landmarks.distance(ref1, ref2), length)
+                    if not length is None:
+                        self.assertTrue(lower <= length and (upper is None or length <= upper))
+
+    def test_components(self):
+        for rnd, graph, csr_graph, lengths in self.graphs():
+            self.assertEqual(csr_graph.num_components(), nx.number_connected_components(graph))
+
+class Test_Payload(unittest.TestCase):
+
+    def test_link_senses(self):
+        bigram_data = np.zeros(2, dtype=Graph.CSR_Graph.EDGE_DTYPE)
+        bigram_data['sense1_id'] = [10, 30]
+        bigram_data['sense2_id'] = [20, 40]
+        bigram_data['link_id'] = [1, 70000]
+        bigram_data['relation_id'] = [2, 70001]
+        link_names = np.array(['', 'link'] + [''] * 69998 + ['far link'])
+        graph = Graph.CSR_Graph.from_edges([1, 3], [2, 2], [5, 6], largest_component=False, bigram_data=bigram_data, link_names=link_names)
+        self.assertEqual(graph.link_senses(1, 2), ('link', 10, 20))
+        self.assertEqual(graph.link_senses(2, 1), ('link', 20, 10))
+        self.assertEqual(graph.link_senses(3, 2), ('far link', 30, 40))
+        self.assertEqual(graph.link_senses(2, 3), ('far link', 40, 30))
+        self.assertEqual(int(graph.edge_data[graph.edge(2, 3)]['relation_id']), 70001)
+
+class Test_Lexicon(unittest.TestCase):
+
+    WORDS = [(5, 'dog'), (2, 'Dog'), (9, u'caf\xe9'), (7, 'Cat'), (1, '')] + [(100 + num, 'word%d' % (num)) for num in range(40)]
+
+    def test_lookups(self):
+        lexicon = Graph.Lexicon.from_words(self.WORDS)
+        self.assertEqual(len(lexicon), len(self.WORDS))
+        for word_id, word in self.WORDS:
+            self.assertEqual(lexicon.word(word_id), word if isinstance(word, str) else word.encode('utf-8'))
+            self.assertEqual(lexicon.word_id(word), word_id)
+        self.assertEqual(lexicon.word_id(u'caf\xe9'.encode('utf-8')), 9)
+        # exact matches first, then a case insensitive one
+        self.assertEqual(lexicon.word_id('cat'), 7)
+        self.assertTrue(lexicon.word_id('DOG') in [2, 5])
+        self.assertEqual((lexicon.word(3), lexicon.word_id('cow')), (None, None))
+        empty = Graph.Lexicon.from_words([])
+        self.assertEqual((len(empty), empty.word(5), empty.word_id('dog')), (0, None, None))
+
+    def test_snapshot(self):
+        dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(dir, 'graph.snapshot')
+            graph = Graph.CSR_Graph.from_edges([5, 2], [2, 9], [0, 1])
+            graph.lexicon = Graph.Lexicon.from_words(self.WORDS)
+            graph.save(path)
+            lexicon = Graph.CSR_Graph.load(path, verify=True).lexicon
+            self.assertEqual(lexicon.fingerprint(), graph.lexicon.fingerprint())
+            self.assertEqual((lexicon.word(9), lexicon.word_id('Dog')), (u'caf\xe9'.encode('utf-8'), 2))
+            graph.lexicon = None
+            graph.save(path)
+            self.assertIsNone(Graph.CSR_Graph.load(path).lexicon)
+        finally:
+            shutil.rmtree(dir)
+
+class Test_Gloss_Store(unittest.TestCase):
+
+    GLOSSES = [(30, 'a dog'), (10, 'a cat'), (20, 'a dog'), (40, None), (50, u'a caf\xe9'), (60, '')]
+
+    def check(self, store):
+        self.assertEqual(len(store), len(self.GLOSSES))
+        for sense_id, gloss in self.GLOSSES:
+            self.assertEqual(store.gloss(sense_id), gloss if not isinstance(gloss, unicode) else gloss.encode('utf-8'))
+        self.assertIsNone(store.gloss(35))
+        self.assertEqual(store.get_glosses([10, 40, 99, 10]), {10: 'a cat', 40: None, 99: None})
+
+    def test_glosses(self):
+        store = Graph.Gloss_Store.from_glosses(self.GLOSSES)
+        self.check(store)
+        # each distinct gloss is stored once
+        self.assertEqual(len(store.offsets) - 1, 4)
+        self.assertEqual(len(Graph.Gloss_Store.from_glosses([])), 0)
+
+    def test_snapshot(self):
+        dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(dir, 'graph.glosses')
+            Graph.Gloss_Store.from_glosses(self.GLOSSES).save(path, meta={'fingerprint': 'test'})
+            store = Graph.Gloss_Store.load(path, verify=True)
+            self.check(store)
+            self.assertEqual(store.meta['fingerprint'], 'test')
+            Graph.Snapshot.write(path, {'sense_ids': store.sense_ids}, {})
+            self.assertRaises(Graph.SnapshotError, Graph.Gloss_Store.load, path)
+        finally:
+            shutil.rmtree(dir)
+
+class Test_Pair_Index(unittest.TestCase):
+
+    def setUp(self):
+        self.graph, self.csr_graph = random_graph(random.Random(3), 3)
+        self.lengths = nx.all_pairs_shortest_path_length(self.graph)
+
+    def check(self, pairs):
+        distances = pairs.distances()
+        for head, tail, distance in zip(pairs.heads.tolist(), pairs.tails.tolist(), distances.tolist()):
+            self.assertEqual(self.lengths[head][tail], distance)
+        self.assertTrue(set(pairs.heads.tolist()) <= set(pairs.sources.tolist()))
+        self.assertFalse(set(pairs.stale.tolist()) & set(pairs.sources.tolist()))
+
+    def test_refresh(self):
+        pairs = Graph.Pair_Index.empty().refresh(self.csr_graph, 5)
+        self.check(pairs)
+        self.assertEqual(len(pairs.sources), 5)
+
+        # more sources keep the pairs already sampled
+        more = pairs.refresh(self.csr_graph, 8, seed=1)
+        self.check(more)
+        self.assertEqual(more.sources[:5].tolist(), pairs.sources.tolist())
+        self.assertTrue(set(zip(pairs.heads.tolist(), pairs.tails.tolist())) <= set(zip(more.heads.tolist(), more.tails.tolist())))
+
+        # stale pairs are dropped and their sources searched again, a few at a time
+        stale = more.refresh(self.csr_graph, 8, stale=True, max_searches=3)
+        self.check(stale)
+        self.assertEqual((len(stale.sources), len(stale.stale)), (3, 5))
+        self.assertEqual(sorted(stale.sources.tolist() + stale.stale.tolist()), sorted(more.sources.tolist()))
+        done = stale.refresh(self.csr_graph, 8)
+        self.check(done)
+        self.assertEqual((len(done.stale), sorted(done.sources.tolist())), (0, sorted(more.sources.tolist())))
+
+    def test_removed_sources(self):
+        pairs = Graph.Pair_Index.empty().refresh(self.csr_graph, 6).refresh(self.csr_graph, 6, stale=True, max_searches=0)
+        self.assertEqual((len(pairs.sources), len(pairs.stale)), (0, 6))
+        # stale sources no longer in the graph are replaced by new ones
+        edges = [(ref1, ref2) for ref1, ref2 in self.graph.edges() if not pairs.stale[0] in (ref1, ref2)]
+        edges = np.array(edges, dtype=np.uint32)
+        graph = Graph.CSR_Graph.from_edges(edges[:, 0], edges[:, 1], np.arange(len(edges), dtype=np.uint32), largest_component=False)
+        self.lengths = dict([(ref, nx.single_source_shortest_path_length(nx.Graph(edges.tolist()), ref)) for ref in graph.nodes().tolist()])
+        refreshed = pairs.refresh(graph, 6)
+        self.check(refreshed)
+        self.assertEqual(len(refreshed.sources), 6)
+        self.assertFalse(pairs.stale[0] in refreshed.sources)
+
+class Test_Snapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'graph.snapshot')
+        graph, self.graph = random_graph(random.Random(1), 1)
+        self.graph.save(self.path, meta={'fingerprint': 'test'})
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_round_trip(self):
+        graph = Graph.CSR_Graph.load(self.path, verify=True)
+        for name in Graph.CSR_Graph.ARRAYS:
+            self.assertTrue(np.array_equal(getattr(graph, name), getattr(self.graph, name)))
+        self.assertEqual(graph.meta['fingerprint'], 'test')
+        self.assertEqual(graph.meta['checksum'], self.graph.meta['checksum'])
+        self.assertEqual(graph.num_components(), self.graph.num_components())
+
+    def test_truncated(self):
+        with open(self.path, 'rb') as fp:
+            data = fp.read()
+        # the file ends with the alignment padding of its last array, which can go unnoticed
+        for size in range(0, len(data) - Graph.Snapshot.ALIGN + 1, 7):
+            with open(self.path, 'wb') as fp:
+                fp.write(data[:size])
+            self.assertRaises(Graph.SnapshotError, Graph.CSR_Graph.load, self.path)
+
+    def test_corrupt(self):
+        # within node_ids, the last array in the file
+        with open(self.path, 'r+b') as fp:
+            fp.seek(-Graph.Snapshot.ALIGN, os.SEEK_END)
+            byte = fp.read(1)
+            fp.seek(-Graph.Snapshot.ALIGN, os.SEEK_END)
+            fp.write(chr(ord(byte) ^ 0xff))
+        Graph.CSR_Graph.load(self.path)
+        self.assertRaises(Graph.SnapshotError, Graph.CSR_Graph.load, self.path, verify=True)
+
+    def test_landmarks(self):
+        path = os.path.join(self.dir, 'graph.landmarks')
+        landmarks = Graph.Landmarks.build(self.graph, num_landmarks=4).save(path)
+        loaded = Graph.Landmarks.load(self.graph, path, verify=True)
+        # bounds are read from the mapped table itself
+        self.assertFalse(loaded.node_distances.flags.owndata)
+        self.assertTrue(np.array_equal(loaded.node_distances, landmarks.node_distances))
+        refs = self.graph.node_ids.tolist()
+        for ref1 in refs:
+            for ref2 in refs:
+                self.assertEqual(loaded.bounds(ref1, ref2), landmarks.bounds(ref1, ref2))
+        Graph.Snapshot.write(path, {'landmark_ids': landmarks.landmark_ids, 'distances': landmarks.node_distances.T}, {})
+        self.assertRaises(Graph.SnapshotError, Graph.Landmarks.load, self.graph, path)
+
+    def test_arrays(self):
+        arrays = {'empty': np.empty(0, dtype=np.uint32), 'odd': np.arange(3, dtype=np.uint8), 'wide': np.arange(6, dtype=np.int64).reshape(2, 3),
+                  'edges': np.zeros(2, dtype=Graph.CSR_Graph.EDGE_DTYPE)}
+        checksum = Graph.Snapshot.write(self.path, dict(arrays), {'name': 'arrays'})
+        read, meta = Graph.Snapshot.read(self.path, verify=True)
+        self.assertEqual((meta['name'], meta['checksum']), ('arrays', checksum))
+        for name, array in arrays.items():
+            self.assertEqual(read[name].dtype, array.dtype)
+            self.assertTrue(np.array_equal(read[name], array))
+            # in place in the mapped file, aligned for its dtype
+            self.assertFalse(read[name].flags.owndata or read[name].flags.writeable)
+            self.assertEqual(read[name].ctypes.data % Graph.Snapshot.ALIGN, 0)
+
+    def test_version(self):
+        with open(self.path, 'r+b') as fp:
+            magic, version, header_len = Graph.Snapshot.PREFIX.unpack(fp.read(Graph.Snapshot.PREFIX.size))
+            for prefix in [('BACONXXX', version, header_len), (magic, version + 1, header_len)]:
+                fp.seek(0)
+                fp.write(Graph.Snapshot.PREFIX.pack(*prefix))
+                fp.flush()
+                self.assertRaises(Graph.SnapshotError, Graph.Snapshot.read, self.path)
+
+    def test_header(self):
+        for header in [{'arrays': {}, 'checksum': 0}, {'arrays': {}, 'meta': {}}, {'arrays': {}, 'meta': [], 'checksum': 0}, [], '{']:
+            header = json.dumps(header)
+            with open(self.path, 'wb') as fp:
+                fp.write(Graph.Snapshot.PREFIX.pack(Graph.Snapshot.MAGIC, Graph.Snapshot.VERSION, len(header)) + header)
+            self.assertRaises(Graph.SnapshotError, Graph.Snapshot.read, self.path)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+#! /usr/bin/env python
+"""
+Checks of the cache policies.
+
+    python -m unittest test_tools
+"""
+import noodle as nt
+import unittest
+
+class Test_Cache(unittest.TestCase):
+
+    def test_lru(self):
+        cache = nt.Tools.Cache(max_entries=2, policy='lru')
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertEqual(sorted(cache.entries_), ['a', 'c'])
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_lfu(self):
+        cache = nt.Tools.Cache(max_entries=2, policy='lfu')
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.get('a')
+        cache.get('b')
+        cache.put('c', 3)
+        self.assertEqual(sorted(cache.entries_), ['a', 'c'])
+        # c was used once, so it goes before a, however recently it was used
+        cache.put('d', 4)
+        self.assertEqual(sorted(cache.entries_), ['a', 'd'])
+
+    def test_max_size(self):
+        cache = nt.Tools.Cache(max_size=10, sizeof=len, policy='lru')
+        for key in 'abcd':
+            cache.put(key, 'x' * 4)
+        self.assertEqual(sorted(cache.entries_), ['c', 'd'])
+        self.assertEqual(cache.stats()['size'], 8)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+
+if __name__ == '__main__':
+    unittest.main()